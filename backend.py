@@ -1,11 +1,26 @@
 import asyncio
+import bisect
 import configparser
+import functools
+import json
+import math
+import os
+import queue
+import re
 import sqlite3
+import threading
 from datetime import datetime
 import discord
 import logging
 import aiohttp
+from aiohttp import web
 import sys
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
 
 from discord import Embed
 from discord.ext import commands
@@ -13,60 +28,350 @@ from colorlog import ColoredFormatter
 import requests
 import mysql.connector
 
-def get_db(storage_method_override=None) -> tuple:
 
-    if storage_method_override is not None:
-        if storage_method_override == "mysql":
-            con = mysql.connector.connect(**mysql_config)
-            cur = con.cursor(prepared=True)
-        else:
-            con = sqlite3.connect('./data/data.db')
-            cur = con.cursor()
+class ConnectionPool:
+    """
+    A thread-safe pool of database connections.
+    Up to `size` idle connections are kept open for reuse. When all of them are in use, an extra connection is opened
+    and closed again on release, so that acquiring never blocks the event loop.
+    """
 
-        return con, cur
+    def __init__(self, connect, size: int, health_check_interval: int):
+        self._connect = connect
+        self.health_check_interval = health_check_interval
+        # LIFO, so that the most recently used (and most likely still alive) connection is reused first
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=size)
 
-    if storage_method == "mysql":
-        con = mysql.connector.connect(**mysql_config)
+    def acquire(self):
+        while True:
+            try:
+                con, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+
+            # Connections that sat idle for a while might have been dropped by the server
+            if time.monotonic() - released_at < self.health_check_interval or self._is_healthy(con):
+                return con
+
+            console.debug("Dropping a dead database connection from the pool.")
+            self._close(con)
+
+    def release(self, con):
+        try:
+            con.rollback()  # Throw away anything that wasn't committed, like closing the connection would
+        except Exception:
+            self._close(con)
+            return
+
+        try:
+            self._idle.put_nowait((con, time.monotonic()))
+        except queue.Full:
+            self._close(con)
+
+    @staticmethod
+    def _is_healthy(con) -> bool:
+        try:
+            if isinstance(con, sqlite3.Connection):
+                con.execute("SELECT 1")
+            else:
+                con.ping(reconnect=True, attempts=1, delay=0)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(con):
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+class PooledConnection:
+    """A connection checked out from a ConnectionPool. close() returns it to the pool instead of closing it."""
+
+    def __init__(self, pool: ConnectionPool, con, cur):
+        self._pool = pool
+        self._con = con
+        self._cur = cur
+
+    def close(self):
+        if self._con is None:
+            return
+
+        try:
+            self._cur.close()
+        except Exception:
+            pass
+
+        self._pool.release(self._con)
+        self._con = self._cur = None
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+_db_pools: dict[str, ConnectionPool] = {}
+_db_pools_lock = threading.Lock()
+
+
+def _get_pool(method: str) -> ConnectionPool:
+    with _db_pools_lock:
+        if method not in _db_pools:
+            if method == "mysql":
+                connect = lambda: mysql.connector.connect(**mysql_config)
+            else:
+                # Pooled connections are handed between threads, but only ever used by one at a time
+                connect = lambda: sqlite3.connect('./data/data.db', check_same_thread=False)
+
+            _db_pools[method] = ConnectionPool(connect, db_pool_size, db_health_check_interval)
+
+        return _db_pools[method]
+
+
+def get_db(storage_method_override=None) -> tuple:
+    """
+    Get a pooled connection and a cursor. con.close() returns the connection to the pool.
+    Prefer db_connection(), which makes sure that happens.
+    """
+    method = storage_method_override if storage_method_override is not None else storage_method
+    method = "mysql" if method == "mysql" else "sqlite"
+
+    pool = _get_pool(method)
+    con = pool.acquire()
+
+    if method == "mysql":
         cur = con.cursor(prepared=True)
     else:
-        con = sqlite3.connect('./data/data.db')
         cur = con.cursor()
 
-    return con, cur
+    return PooledConnection(pool, con, cur), cur
+
+
+@contextmanager
+def db_connection(storage_method_override=None):
+    """
+    Context manager version of get_db(). The connection is returned to the pool when the block exits,
+    and anything that wasn't committed is rolled back.
+
+        with db_connection() as (con, cur):
+            cur.execute(...)
+            con.commit()
+    """
+    con, cur = get_db(storage_method_override)
+    try:
+        yield con, cur
+    finally:
+        con.close()
+
+
+# Database I/O runs on these threads instead of the event loop. Created on first use, since the size is in the config
+_db_executor: ThreadPoolExecutor | None = None
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    global _db_executor
+
+    if _db_executor is None:
+        # sqlite only allows one writer at a time anyway, so more threads would just wait on its lock
+        threads = db_threads if db_threads > 0 else (db_pool_size if storage_method == "mysql" else 1)
+        _db_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db")
+
+    return _db_executor
+
+
+async def run_db(func, *args, storage_method_override=None):
+    """Run func(con, cur, *args) with a pooled connection on a database thread, and return its result."""
+    def job():
+        with db_connection(storage_method_override) as (con, cur):
+            return func(con, cur, *args)
+
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_db_executor(), job)
+    finally:
+        record_time("db", time.perf_counter() - start)
+
+
+# Raised when the database rejects a row (eg. a duplicate unique key), with either storage method
+db_integrity_errors = (sqlite3.IntegrityError, mysql.connector.errors.IntegrityError)
+
+
+async def db_fetchone(query: str, params: tuple = ()) -> tuple | None:
+    def job(con, cur):
+        cur.execute(query, params)
+        return cur.fetchone()
+
+    return await run_db(job)
+
+
+async def db_fetchall(query: str, params: tuple = ()) -> list:
+    def job(con, cur):
+        cur.execute(query, params)
+        return cur.fetchall()
+
+    return await run_db(job)
+
+
+async def db_execute(query: str, params: tuple = ()) -> int:
+    """Execute and commit a query. Returns the number of affected rows."""
+    def job(con, cur):
+        cur.execute(query, params)
+        con.commit()
+        return cur.rowcount
+
+    return await run_db(job)
+
+
+async def db_executemany(query: str, seq_of_params: list) -> int:
+    """Execute a query for every set of parameters and commit them together. Returns the number of affected rows."""
+    def job(con, cur):
+        cur.executemany(query, seq_of_params)
+        con.commit()
+        return cur.rowcount
+
+    return await run_db(job)
+
+
+async def db_stream(select: str, key_column: str, where: str = "", params: tuple = (), key_index: int = 0,
+                    chunk_size: int = None):
+    """
+    Yield the rows of `select` (a SELECT ... FROM ... without a WHERE clause) ordered by key_column, which has to be
+    unique and at key_index in the selected columns. Rows are fetched chunk_size at a time with keyset pagination,
+    so only one chunk is ever in memory and every chunk is an index seek.
+    """
+    chunk_size = chunk_size or db_chunk_size
+    last_key = None
+
+    while True:
+        conditions = [f"({where})"] if where else []
+        args = [*params]
+        if last_key is not None:
+            conditions.append(f"{key_column} > ?")
+            args.append(last_key)
+
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await db_fetchall(f"{select}{where_clause} ORDER BY {key_column} LIMIT ?", (*args, chunk_size))
+
+        for row in rows:
+            yield row
+
+        if len(rows) < chunk_size:
+            return
+        last_key = rows[-1][key_index]
+
+
+# The category shown by /owners logs for records logged from each file
+log_categories = {
+    "commands.py": "command",
+    "listeners.py": "listener",
+    "backend.py": "backend",
+}
 
 
 class SQLHandler(logging.Handler):
-    """Custom logging handler that saves log messages to a database."""
+    """
+    Custom logging handler that saves log messages to a database.
+    Records are queued and written in batches by a background thread, so logging never waits on the database.
+    """
 
-    def __init__(self):
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5, max_queue_size: int = 10000):
         super().__init__()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0  # Records lost because the queue was full or the database write failed
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._writer, name="sql-log-writer", daemon=True)
+        self._thread.start()
+
+    def configure(self, batch_size: int, flush_interval: float, max_queue_size: int):
+        """Apply the [logging] settings, which are only read after the logger is created."""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue.maxsize = max_queue_size
 
     def emit(self, record):
-        """Insert a log record into the database."""
+        """Queue a log record to be inserted into the database."""
         if record.levelname.upper() == "DEBUG":
             return
 
+        try:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            level = record.levelname
+            message = self.format(record)
+            filename = record.pathname  # Full file path
+            category = log_categories.get(os.path.basename(filename), "etc")
+            function_name = record.funcName  # Function name
+            line_number = record.lineno  # Line number
+            thread_name = record.threadName  # Thread name
+            process_id = record.process  # Process ID
+            exception_info = record.exc_text if record.exc_info else None  # Exception details
+        except Exception:
+            self.handleError(record)
+            return
 
-        con, cur = get_db()
+        try:
+            self._queue.put_nowait(
+                (timestamp, level, category, filename, function_name, line_number, thread_name, process_id, message,
+                 exception_info)
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        """Collect queued records and write them once batch_size is reached or flush_interval has passed."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = False
+
+            # None is the stop signal from close()
+            if row is None:
+                self._write(batch)
+                return
 
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        level = record.levelname
-        message = self.format(record)
-        filename = record.pathname  # Full file path
-        function_name = record.funcName  # Function name
-        line_number = record.lineno  # Line number
-        thread_name = record.threadName  # Thread name
-        process_id = record.process  # Process ID
-        exception_info = record.exc_text if record.exc_info else None  # Exception details
+            if row:
+                batch.append(row)
 
-        cur.execute(
-            "INSERT INTO logs (timestamp, level, filename, function_name, line_number, thread_name, process_id, message, exception_info) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (timestamp, level, filename, function_name, line_number, thread_name, process_id, message, exception_info),
-        )
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, rows: list):
+        if not rows:
+            return
+
+        try:
+            with db_connection() as (con, cur):
+                cur.executemany(
+                    "INSERT INTO logs (timestamp, level, category, filename, function_name, line_number, thread_name, "
+                    "process_id, message, exception_info) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+
+                con.commit()
+        except Exception as e:
+            # Logging this through the logger would just queue it up again
+            self.dropped += len(rows)
+            sys.stderr.write(f"Could not write {len(rows)} log records to the database. Error: {e}\n")
+
+    def close(self):
+        """Write everything that is still queued. Called by logging on shutdown."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+
+        if self.dropped:
+            sys.stderr.write(f"{self.dropped} log records could not be saved to the database.\n")
+
+        super().close()
 
-        con.commit()
-        con.close()
 
 # Initializing the logger
 def colorlogger(name='bps-circular-bot'):
@@ -123,6 +428,52 @@ try:
     embed_color: int = int(config.get('discord', 'embed_color'), base=16)
     embed_title: str = config.get('discord', 'embed_title')
     embed_url: str = config.get('discord', 'embed_url')
+    member_count_concurrency: int = config.getint('discord', 'member_count_concurrency', fallback=10)
+
+    # These have defaults so that older config.ini files keep working
+    api_pool_limit: int = config.getint('api', 'pool_limit', fallback=100)
+    api_pool_limit_per_host: int = config.getint('api', 'pool_limit_per_host', fallback=20)
+    api_keepalive_timeout: int = config.getint('api', 'keepalive_timeout', fallback=60)
+    api_dns_cache_ttl: int = config.getint('api', 'dns_cache_ttl', fallback=300)
+    api_category_concurrency: int = config.getint('api', 'category_concurrency', fallback=4)
+    api_cache_size: int = config.getint('api', 'cache_size', fallback=512)
+    api_cache_ttls: dict = {
+        'list': config.getint('api', 'list_cache_ttl', fallback=circular_check_interval * 60),
+        'latest': config.getint('api', 'latest_cache_ttl', fallback=circular_check_interval * 60),
+        'search': config.getint('api', 'search_cache_ttl', fallback=300),
+        'getpng': config.getint('api', 'getpng_cache_ttl', fallback=86400),
+    }
+    api_negative_cache_ttl: int = config.getint('api', 'negative_cache_ttl', fallback=60)
+    api_breaker_failure_threshold: int = config.getint('api', 'breaker_failure_threshold', fallback=3)
+    api_breaker_reset_timeout: float = config.getfloat('api', 'breaker_reset_timeout', fallback=30)
+    api_hedge_requests: bool = config.getboolean('api', 'hedge_requests', fallback=True)
+
+    db_pool_size: int = config.getint('database', 'pool_size', fallback=5)
+    db_health_check_interval: int = config.getint('database', 'health_check_interval', fallback=30)
+    db_threads: int = config.getint('database', 'threads', fallback=0)
+    db_chunk_size: int = config.getint('database', 'chunk_size', fallback=1000)
+
+    log_batch_size: int = config.getint('logging', 'batch_size', fallback=100)
+    log_flush_interval: float = config.getfloat('logging', 'flush_interval', fallback=5)
+    log_max_queue_size: int = config.getint('logging', 'max_queue_size', fallback=10000)
+
+    notify_workers: int = config.getint('notifications', 'workers', fallback=10)
+    notify_max_rate: float = config.getfloat('notifications', 'max_rate', fallback=40)
+    notify_progress_interval: int = config.getint('notifications', 'progress_interval', fallback=10)
+    notify_write_batch_size: int = config.getint('notifications', 'write_batch_size', fallback=500)
+    notify_write_interval: float = config.getfloat('notifications', 'write_interval', fallback=5)
+    notify_max_attempts: int = config.getint('notifications', 'max_attempts', fallback=3)
+    notify_retry_delay: int = config.getint('notifications', 'retry_delay', fallback=60)
+
+    # A pool of 0 workers would never deliver anything, without any error
+    for _name, _value in (('[notifications] workers', notify_workers),
+                          ('[api] category_concurrency', api_category_concurrency),
+                          ('[discord] member_count_concurrency', member_count_concurrency)):
+        if _value < 1:
+            raise ValueError(f"{_name} must be at least 1, not {_value}")
+
+    metrics_host: str = config.get('metrics', 'host', fallback="127.0.0.1").strip()
+    metrics_port: int = config.getint('metrics', 'port', fallback=0)
 
     if storage_method == "mysql":
         mysql_config: dict = {
@@ -139,6 +490,11 @@ except Exception as err:
     console.critical("Error reading the config.ini file. Error: " + str(err))
     sys.exit()
 
+# The database log handler is created before the config is read
+for _handler in console.handlers:
+    if isinstance(_handler, SQLHandler):
+        _handler.configure(log_batch_size, log_flush_interval, log_max_queue_size)
+
 # Log Level
 if log_level.upper() in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
     console.setLevel(log_level.upper())
@@ -174,153 +530,1280 @@ for i in range(len(statuses)):
 
 
 
-async def send_async_api_request(url: str, params: dict = None, fallback=False) -> dict | None:
-    timeout = aiohttp.ClientTimeout(total=5, connect=2)
-    try:
-        console.debug(f"Sending API request to {url} with params: {params}")
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, params=params) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    console.debug(f"Received successful response from {url}")
-                    return data['data']
-                elif resp.status == 422:
-                    console.error(f"API returned status 422 for {url}. Params: {params}")
-                else:
-                    console.error(f"API returned status {resp.status} for {url}")
-                    return None
-    except asyncio.TimeoutError:
-        if fallback:
-            console.error(f"API request to {url} timed out. Fallback also timed out.")
-            return None
-        else:
-            console.warning(f"API request to {url} timed out. Trying fallback API.")
-            return await send_async_api_request(fallback_api_url + url.split(base_api_url)[1], params, True)
-    except aiohttp.ClientError as e:
-        if fallback:
-            console.error(f"Error while connecting to the API at {url}. Error: {e}")
+
+class Histogram:
+    """A Prometheus style histogram: how many observations fell into each bucket, and their count and sum."""
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # In seconds
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """Estimate the q quantile (eg. 0.95) from the buckets, the same way Prometheus' histogram_quantile() does."""
+        if self.count == 0:
             return None
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+
+        return self.buckets[-1]
+
+
+metric_descriptions = {
+    'bot_operation_seconds': "How long slash commands and background tasks took (part=total), and how much of that was "
+                             "spent waiting on the API, the database and discord. Concurrent waits add up separately.",
+    'bot_api_request_seconds': "How long single requests to the BPS API took, by host and endpoint.",
+    'bot_api_fallbacks_total': "Requests that were answered by the fallback API.",
+    'bot_api_hedged_requests_total': "Requests that were also sent to the fallback API because the base API was slow.",
+    'bot_api_breaker_opened_total': "The number of times an API host was skipped for failing too often, by host.",
+    'bot_cache_requests_total': "Lookups in the API response cache and the PNG cache, by result.",
+    'bot_api_coalesced_total': "API requests that waited for an identical request already in flight instead.",
+    'bot_searches_total': "Circular searches, by whether the local index or the API answered them.",
+    'bot_notifications_total': "Notification deliveries, by recipient type and outcome.",
+    'bot_discord_rate_limited_total': "429s discord answered the bot's requests with.",
+    'bot_discord_global_rate_limited_total': "429s that were for discord's global rate limit.",
+    'bot_discord_retry_after_seconds_total': "The time discord told the bot to wait after 429s.",
+    'bot_discord_limiter_wait_seconds_total': "The time notification requests waited for the rate limiter.",
+}
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Counters and histograms of what the bot spends its time on, kept in memory and rendered for Prometheus."""
+
+    def __init__(self):
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.gauges: dict[str, tuple[str, callable]] = {}
+
+    def inc(self, metric: str, amount: float = 1, **labels):
+        series = self.counters.setdefault(metric, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, metric: str, value: float, **labels):
+        series = self.histograms.setdefault(metric, {})
+        key = tuple(sorted(labels.items()))
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    def histogram(self, metric: str, **labels) -> Histogram | None:
+        return self.histograms.get(metric, {}).get(tuple(sorted(labels.items())))
+
+    def gauge(self, name: str, description: str, func):
+        """Register a gauge, whose value is func() at the time the metrics are rendered."""
+        self.gauges[name] = (description, func)
+
+    @staticmethod
+    def _labels(labels: tuple, **extra) -> str:
+        labels = labels + tuple(extra.items())
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        lines = []
+
+        for name, series in sorted(self.counters.items()):
+            lines += [f"# HELP {name} {metric_descriptions.get(name, name)}", f"# TYPE {name} counter"]
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for name, (description, func) in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception as e:
+                console.debug(f"Could not get the value of the {name} gauge. Error: {e}")
+                continue
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+        for name, series in sorted(self.histograms.items()):
+            lines += [f"# HELP {name} {metric_descriptions.get(name, name)}", f"# TYPE {name} histogram"]
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, le=bucket)} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+# The time the running command or task has spent waiting on the API, the database and discord
+_operation_times: ContextVar[dict | None] = ContextVar("operation_times", default=None)
+
+
+def record_time(part: str, seconds: float):
+    """Add waiting time to the command or task that is running, if there is one."""
+    times = _operation_times.get()
+    if times is not None:
+        times[part] += seconds
+
+
+@contextmanager
+def timed_operation(kind: str, name: str):
+    """Time a command or task, and how much of it was spent waiting on the API, the database and discord."""
+    times = {'api': 0.0, 'db': 0.0, 'discord': 0.0}
+    token = _operation_times.set(times)
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        _operation_times.reset(token)
+        metrics.observe("bot_operation_seconds", time.perf_counter() - start, kind=kind, name=name, part="total")
+        for part, seconds in times.items():
+            metrics.observe("bot_operation_seconds", seconds, kind=kind, name=name, part=part)
+
+
+def timed_task(func):
+    """Decorator for tasks.loop functions, which times every run with timed_operation()."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timed_operation("task", func.__name__):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+metrics_runner: web.AppRunner | None = None
+
+
+async def start_metrics_server():
+    """Serve the metrics on http://metrics_host:metrics_port/metrics, if a port is set."""
+    global metrics_runner
+
+    if metrics_port <= 0 or metrics_runner is not None:
+        return
+
+    async def handle(_request):
+        return web.Response(body=metrics.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+
+    try:
+        await web.TCPSite(metrics_runner, metrics_host, metrics_port).start()
+    except OSError as e:
+        console.error(f"Could not serve metrics on {metrics_host}:{metrics_port}. Error: {e}")
+        await metrics_runner.cleanup()
+        metrics_runner = None
+        return
+
+    console.info(f"Serving metrics on http://{metrics_host}:{metrics_port}/metrics")
+
+
+async def stop_metrics_server():
+    global metrics_runner
+
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+
+# The shared aiohttp session used for every request to the BPS API
+http_session: aiohttp.ClientSession | None = None
+
+
+async def open_http_session() -> aiohttp.ClientSession:
+    """Create the shared, pooled API session. Must be called from within the running event loop."""
+    global http_session
+
+    if http_session is not None and not http_session.closed:
+        return http_session
+
+    connector = aiohttp.TCPConnector(
+        limit=api_pool_limit,
+        limit_per_host=api_pool_limit_per_host,
+        keepalive_timeout=api_keepalive_timeout,
+        ttl_dns_cache=api_dns_cache_ttl,
+        use_dns_cache=True,
+    )
+    http_session = aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=5, connect=2)
+    )
+    console.debug(
+        f"Opened API session. Pool limit: {api_pool_limit}, per host: {api_pool_limit_per_host}, "
+        f"keep-alive: {api_keepalive_timeout}s, DNS cache: {api_dns_cache_ttl}s"
+    )
+
+    return http_session
+
+
+async def close_http_session():
+    """Close the shared API session and all of its pooled connections."""
+    global http_session
+
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+        console.debug("Closed API session.")
+
+    http_session = None
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one API host, so requests don't wait on a host that is down.
+    After failure_threshold failures in a row the breaker opens, and the host is skipped for reset_timeout seconds.
+    Then it's half open: one request is let through as a probe, which closes the breaker again if it succeeds, or
+    opens it for another reset_timeout if it doesn't.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half open"
+
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a request may be sent to the host. In the half open state, this lets the probe through."""
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+
+        return self.state != self.OPEN
+
+    def success(self):
+        if self.state != self.CLOSED:
+            console.info(f"The API at {self.host} is reachable again.")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            console.warning(f"The API at {self.host} failed {self.failures} time(s) in a row. "
+                            f"Skipping it for {self.reset_timeout} seconds.")
+            metrics.inc("bot_api_breaker_opened_total", host=urlsplit(self.host).netloc)
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def cancelled(self):
+        """The request was cancelled before it finished (eg. it lost a hedge), so it tells nothing about the host."""
+        self._probing = False
+
+
+# The API hosts in the order they are tried. They're often the same, in which case there's nothing to fall back to
+api_hosts = list(dict.fromkeys((base_api_url, fallback_api_url)))
+api_breakers = {
+    host: CircuitBreaker(host, api_breaker_failure_threshold, api_breaker_reset_timeout) for host in api_hosts
+}
+
+
+def api_endpoint_name(endpoint: str) -> str:
+    """The endpoint without its arguments (eg. "list" for "list/general"), for labelling its response times."""
+    return endpoint.split("/", 1)[0]
+
+
+def api_hedge_delay(host: str, endpoint: str) -> float:
+    """
+    How long a request for endpoint to host may take before it's also sent to the next host: its p95 response time.
+    Endpoints are timed separately, since rendering a circular (getpng) takes a lot longer than listing them.
+    """
+    histogram = metrics.histogram(
+        "bot_api_request_seconds", host=urlsplit(host).netloc, endpoint=api_endpoint_name(endpoint)
+    )
+
+    # Until there are enough responses to tell what's slow for this endpoint
+    if histogram is None or histogram.count < 20:
+        return 1.0
+
+    return max(histogram.quantile(0.95), 0.05)
+
+
+async def _request_api_host(host: str, endpoint: str, params: dict = None,
+                            validators: dict = None) -> tuple[int, dict | None]:
+    """
+    Send one request to one API host, and update its circuit breaker. Connection errors, timeouts and malformed
+    responses (ValueError, KeyError) are raised.
+    If a validators dict is passed, the request is conditional on the ETag/Last-Modified in it, and it's updated
+    with the ones of a successful response.
+    """
+    # The session is normally opened on startup, this only covers requests made before that
+    session = await open_http_session()
+    url = host + endpoint
+    breaker = api_breakers[host]
+
+    headers = {}
+    if validators:
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    console.debug(f"Sending API request to {url} with params: {params}")
+    start = time.perf_counter()
+    data = None
+    cancelled = False
+
+    try:
+        async with session.get(url, params=params, headers=headers) as resp:
+            status = resp.status
+
+            if status == 200:
+                data = (await resp.json())['data']
+
+                if validators is not None:
+                    validators.clear()
+                    if 'ETag' in resp.headers:
+                        validators['etag'] = resp.headers['ETag']
+                    if 'Last-Modified' in resp.headers:
+                        validators['last_modified'] = resp.headers['Last-Modified']
+    except asyncio.CancelledError:
+        cancelled = True
+        breaker.cancelled()
+        raise
+    except Exception:
+        # Anything else, like a response that isn't the JSON we expect, counts against the host too. Otherwise a
+        # probe that fails this way would leave the breaker half open for good
+        breaker.failure()
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        record_time("api", elapsed)
+
+        # A cancelled request didn't take its full time, which would skew the hedge delay
+        if not cancelled:
+            metrics.observe(
+                "bot_api_request_seconds", elapsed, host=urlsplit(host).netloc, endpoint=api_endpoint_name(endpoint)
+            )
+
+    # Errors on the API's side mean the host is unhealthy, anything else is an answer
+    if status >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+
+    if status == 200:
+        console.debug(f"Received successful response from {url}")
+    elif status == 304:
+        console.debug(f"{url} has not changed since the last request")
+    elif status == 422:
+        console.error(f"API returned status 422 for {url}. Params: {params}")
+    else:
+        console.error(f"API returned status {status} for {url}")
+
+    return status, data
+
+
+async def _send_api_request(endpoint: str, params: dict = None,
+                            validators: dict = None) -> tuple[int | None, dict | None]:
+    """
+    Send a request for endpoint to the API, returns the HTTP status (None if no API host could be reached) and the data.
+    The hosts are tried in order, skipping the ones whose circuit breaker is open. With hedge_requests on, a request
+    that takes longer than its host's p95 for the endpoint is also sent to the next host, and whichever answers first
+    is used.
+    If a validators dict is passed, the request is conditional on the ETag/Last-Modified the previous response saved
+    in it, and (304, None) is returned if nothing changed since.
+    """
+    waiting = list(api_hosts)
+    running: dict[asyncio.Task, tuple[str, dict | None]] = {}
+    status = None
+
+    def start_next() -> bool:
+        while waiting:
+            host = waiting.pop(0)
+            if not api_breakers[host].allow():
+                console.debug(f"Skipping the API at {host}, it is down.")
+                continue
+
+            # Each request gets its own copy, so only the response that is used updates them
+            _validators = dict(validators) if validators is not None else None
+            running[asyncio.create_task(_request_api_host(host, endpoint, params, _validators))] = (host, _validators)
+            return True
+        return False
+
+    try:
+        start_next()
+
+        while running:
+            # Only one request is hedged at a time
+            hedge = api_hedge_requests and waiting and len(running) == 1
+            timeout = api_hedge_delay(next(iter(running.values()))[0], endpoint) if hedge else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                if start_next():
+                    console.debug(f"The API is slow to answer {endpoint}. Also sending it to the next host.")
+                    metrics.inc("bot_api_hedged_requests_total")
+                continue
+
+            for task in done:
+                host, _validators = running.pop(task)
+
+                try:
+                    status, data = task.result()
+                except Exception as e:
+                    console.warning(f"Error while requesting {endpoint} from the API at {host}. Error: {e!r}")
+                    status = None
+                    continue
+
+                if status < 500:
+                    if host != api_hosts[0]:
+                        metrics.inc("bot_api_fallbacks_total")
+                    if status == 200 and validators is not None:
+                        validators.clear()
+                        validators.update(_validators)
+                    return status, data
+
+            # Try the next host, unless a hedged request is still on its way
+            if not running and start_next():
+                console.warning(f"Trying the fallback API for {endpoint}.")
+
+        console.error(f"Could not get {endpoint} from the API.")
+        return status, None
+    finally:
+        # The requests that lost the hedge
+        for task in running:
+            task.cancel()
+
+
+async def send_async_api_request(endpoint: str, params: dict = None) -> dict | None:
+    _, data = await _send_api_request(endpoint, params)
+    return data
+
+
+class APICache:
+    """
+    An in-memory LRU cache for API responses, with a time to live per entry.
+    Keys are (endpoint, params) tuples, see cached_api_request().
+    """
+    MISSING = object()
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: tuple):
+        """Returns the cached value, or APICache.MISSING if there is no fresh entry for the key."""
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            metrics.inc("bot_cache_requests_total", cache="api", result="miss")
+            return self.MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        metrics.inc("bot_cache_requests_total", cache="api", result="hit")
+        return entry[1]
+
+    def set(self, key: tuple, value, ttl: int):
+        if ttl <= 0 or self.max_size <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        # Evict the least recently used entries
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *prefixes: str):
+        """Remove all entries whose endpoint starts with any of the prefixes. Removes everything if none are given."""
+        if not prefixes:
+            self._entries.clear()
+            return
+
+        for key in [key for key in self._entries if key[0].startswith(prefixes)]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class SingleFlight:
+    """Makes concurrent calls with the same key share one in-flight call instead of each making their own."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: dict[tuple, asyncio.Future] = {}
+
+    async def do(self, key: tuple, coro_func):
+        """Await coro_func(), or the already running call for key if there is one."""
+        self.calls += 1
+        future = self._in_flight.get(key)
+
+        if future is not None:
+            self.coalesced += 1
+            metrics.inc("bot_api_coalesced_total")
+            console.debug(f"Coalesced call for {key}")
         else:
-            console.warning(f"Error while connecting to the API at {url}. Trying fallback API. Error: {e}")
-            return await send_async_api_request(fallback_api_url + url.split(base_api_url)[1], params, True)
+            future = asyncio.ensure_future(coro_func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # Shielded so that one caller being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        return {'calls': self.calls, 'coalesced': self.coalesced, 'in_flight': len(self._in_flight)}
+
+
+api_cache = APICache(api_cache_size)
+metrics.gauge("bot_api_cache_entries", "The number of API responses in the cache.", lambda: api_cache.stats()['size'])
+api_single_flight = SingleFlight()
+metrics.gauge("bot_api_in_flight", "The number of distinct API requests in flight.",
+              lambda: api_single_flight.stats()['in_flight'])
+
+
+async def cached_api_request(endpoint: str, params: dict = None) -> dict | None:
+    """
+    Send a request for endpoint to the API, going through api_cache.
+    Successful responses are cached for the endpoint's TTL, 404s and 422s are cached for negative_cache_ttl.
+    Concurrent identical requests are coalesced into one through api_single_flight.
+    """
+    key = (endpoint, tuple(sorted(params.items())) if params else ())
+
+    data = api_cache.get(key)
+    if data is not APICache.MISSING:
+        console.debug(f"API cache hit for {endpoint} with params: {params}")
+        return data
+
+    async def fetch():
+        status, _data = await _send_api_request(endpoint, params)
+
+        if status == 200:
+            api_cache.set(key, _data, api_cache_ttls.get(endpoint.split('/')[0], 0))
+        elif status in (404, 422):
+            api_cache.set(key, None, api_negative_cache_ttl)
+
+        return _data
+
+    # Identical requests that are already on their way to the API are shared
+    return await api_single_flight.do(key, fetch)
+
+def send_api_request(endpoint: str, params: dict = None) -> dict | None:
+    """A blocking version of send_async_api_request(), for before the event loop runs. Tries each API host in order."""
+    for host in api_hosts:
+        url = host + endpoint
+        try:
+            console.debug(f"Sending API request to {url} with params: {params}")
+            response = requests.get(url, params=params, timeout=5)
+            data = response.json()
+            console.debug(f"Received successful response from {url}")
+            return data['data']
+        except requests.exceptions.Timeout:
+            console.warning(f"API request to {url} timed out.")
+        except requests.exceptions.RequestException as e:
+            console.warning(f"Error while connecting to the API at {url}. Error: {e}")
+        except (ValueError, KeyError) as e:
+            console.warning(f"The API at {url} returned an invalid response. Error: {e!r}")
+
+    console.error(f"Could not get {endpoint} from the API.")
+    return None
+
+
+# The categories are needed when the cogs are imported (for the slash command choices), before the bot connects.
+# So they are loaded from a snapshot of the last known ones, and refreshed from the API in the background
+categories_snapshot_path = "./data/categories.json"
+
+
+def save_categories_snapshot(_categories: list[str]):
+    # Written to a temporary file first, so a crash can't leave a half written snapshot behind
+    with open(categories_snapshot_path + ".tmp", "w") as f:
+        json.dump(_categories, f)
+    os.replace(categories_snapshot_path + ".tmp", categories_snapshot_path)
+
+
+def load_categories() -> list[str]:
+    try:
+        with open(categories_snapshot_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    # Only on the first start, when there is no snapshot yet
+    console.warning("No saved categories found. Getting them from the API.")
+    _categories = send_api_request("categories")
+    if _categories is None:
+        console.critical("Could not get categories from the API. Exiting.")
+        sys.exit(1)
+
+    save_categories_snapshot(_categories)
+    return _categories
+
+
+categories = load_categories()
+
+
+async def refresh_categories():
+    """Get the categories from the API, and update the list and the snapshot if they changed."""
+    _categories = await send_async_api_request("categories")
+    if _categories is None:
+        console.warning("Could not refresh the categories from the API. Using the saved ones.")
+        return
+
+    if _categories == categories:
+        return
+
+    # Updated in place, since other modules imported the list itself
+    categories[:] = _categories
+    await asyncio.to_thread(save_categories_snapshot, _categories)
+    console.warning(f"The categories changed to {_categories}. Restart the bot to update the slash command choices.")
+
+
+async def probe_api_latency() -> float | None:
+    """Returns how long a request to the API takes in milliseconds, or None if it couldn't be reached."""
+    session = await open_http_session()
+    start = time.perf_counter()
+
+    try:
+        async with session.get(base_api_url) as resp:
+            await resp.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        console.warning(f"Could not reach the API at {base_api_url}. Error: {e}")
+        return None
+
+    return (time.perf_counter() - start) * 1000
+
+
+# DDL commits right away (always in MySQL, and in SQLite outside of a transaction), before the migration's version is
+# saved. So the migrations use these to add columns and indexes, which can be run again after an interrupted migration
+
+def _column_exists(cur, method: str, table: str, column: str) -> bool:
+    if method == "mysql":
+        cur.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND COLUMN_NAME = ?",
+            (table, column)
+        )
+        return cur.fetchone()[0] > 0
+
+    cur.execute(f"PRAGMA table_info(`{table}`)")
+    return any(row[1] == column for row in cur.fetchall())
+
+
+def _add_column(cur, method: str, table: str, column: str, definition: str):
+    if not _column_exists(cur, method, table, column):
+        cur.execute(f"ALTER TABLE `{table}` ADD COLUMN {column} {definition}")
+
+
+def _create_index(cur, method: str, name: str, table: str, columns: str):
+    if method == "mysql":
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        cur.execute(
+            "SELECT COUNT(*) FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = ? AND INDEX_NAME = ?",
+            (table, name)
+        )
+        if cur.fetchone()[0] > 0:
+            return
+        cur.execute(f"CREATE INDEX {name} ON `{table}` ({columns})")
+    else:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON `{table}` ({columns})")
+
+
+def _migration_baseline(cur, method: str):
+    """The tables as they were before migrations were versioned. Existing databases already have them."""
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS `dm_notify` (user_id BIGINT UNSIGNED NOT NULL, message TEXT "
+        "DEFAULT 'A new Circular was just posted on the website!' )"
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `guild_notify` (
+            guild_id BIGINT UNSIGNED NOT NULL UNIQUE,
+            channel_id BIGINT UNSIGNED UNIQUE,
+            message TEXT DEFAULT 'There''s a new circular up on the website!'
+        )
+        """
+    )
+
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `notif_msgs` (
+            circular_id INT NOT NULL,
+            type TEXT NOT NULL,
+            msg_id BIGINT UNSIGNED NOT NULL UNIQUE,
+            channel_id BIGINT UNSIGNED,
+            guild_id BIGINT UNSIGNED
+        )
+        """
+    )
+
+    # Page image URLs of circulars, so that they don't have to be rendered by the API again
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `png_cache` (
+            link VARCHAR(512) NOT NULL PRIMARY KEY,
+            circular_id INT,
+            png_urls TEXT NOT NULL
+        )
+        """
+    )
+
+    # Used by the feedback buttons under search results, but was only ever created by hand
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `search_feedback` (
+            user_id BIGINT UNSIGNED NOT NULL,
+            message_id BIGINT UNSIGNED NOT NULL UNIQUE,
+            search_query TEXT NOT NULL,
+            response TEXT NOT NULL
+        )
+        """
+    )
+
+    # sqlite only auto-increments INTEGER PRIMARY KEY columns
+    id_column = "id INT AUTO_INCREMENT PRIMARY KEY" if method == "mysql" else "id INTEGER PRIMARY KEY"
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS `logs` (
+            {id_column},
+            timestamp DATETIME NOT NULL,
+            level VARCHAR(50) NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            function_name VARCHAR(255) NOT NULL,
+            line_number INT NOT NULL,
+            thread_name VARCHAR(255) NOT NULL,
+            process_id INT NOT NULL,
+            message TEXT NOT NULL,
+            exception_info TEXT NULL
+        )
+        """
+    )
+
+
+def _migration_notif_msgs_index(cur, method: str):
+    # MySQL can only index TEXT columns by a prefix, and the type is only ever "guild" or "dm"
+    if method == "mysql":
+        cur.execute("ALTER TABLE notif_msgs MODIFY type VARCHAR(16) NOT NULL")
+
+    # editnotif/deletenotif look up the messages of a circular by its id and type
+    _create_index(cur, method, "idx_notif_msgs_circular_type", "notif_msgs", "circular_id, type")
+    _create_index(cur, method, "idx_png_cache_circular_id", "png_cache", "circular_id")
+
+
+def _migration_unique_dm_notify(cur, method: str):
+    # Rebuild the table, keeping one row per user, since neither database can add a constraint to duplicated data
+    cur.execute("DROP TABLE IF EXISTS dm_notify_new")
+    cur.execute(
+        "CREATE TABLE dm_notify_new (user_id BIGINT UNSIGNED NOT NULL UNIQUE, message TEXT "
+        "DEFAULT 'A new Circular was just posted on the website!' )"
+    )
+    cur.execute("INSERT INTO dm_notify_new (user_id, message) SELECT user_id, MAX(message) FROM dm_notify GROUP BY user_id")
+
+    if method == "mysql":
+        # MySQL commits every DDL statement on its own, so the tables are swapped with one atomic RENAME and
+        # dm_notify exists at every point. If this stops before the version is saved, the rerun rebuilds from the
+        # already swapped table
+        cur.execute("DROP TABLE IF EXISTS dm_notify_old")
+        cur.execute("RENAME TABLE dm_notify TO dm_notify_old, dm_notify_new TO dm_notify")
+        cur.execute("DROP TABLE dm_notify_old")
+    else:
+        # The INSERT started a transaction, which the DROP and the rename are part of in SQLite. init_database()
+        # commits it together with the schema version
+        cur.execute("DROP TABLE dm_notify")
+        cur.execute("ALTER TABLE dm_notify_new RENAME TO dm_notify")
+
+
+def _migration_logs_category(cur, method: str):
+    # /owners logs filters by category, which used to be worked out from the file name on every query
+    _add_column(cur, method, "logs", "category", "VARCHAR(16) NOT NULL DEFAULT 'etc'")
+    for filename, category in log_categories.items():
+        cur.execute("UPDATE logs SET category = ? WHERE filename LIKE ?", (category, f"%{filename}"))
+
+    _create_index(cur, method, "idx_logs_level_category_timestamp", "logs", "level, category, timestamp")
+    _create_index(cur, method, "idx_logs_level_timestamp", "logs", "level, timestamp")
+    _create_index(cur, method, "idx_logs_category_timestamp", "logs", "category, timestamp")
+    _create_index(cur, method, "idx_logs_timestamp", "logs", "timestamp")
+
+
+def _migration_checker_cache(cur, method: str):
+    # Used to be created by pybpsapi's CircularChecker, which the bot doesn't use anymore
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `cache` (
+            category VARCHAR(15) NOT NULL PRIMARY KEY,
+            latest_circular_id INTEGER
+        )
+        """
+    )
+
+
+def _migration_notification_jobs(cur, method: str):
+    # Every new circular becomes a job, so that deliveries interrupted by a restart can be resumed
+    id_column = "id INT AUTO_INCREMENT PRIMARY KEY" if method == "mysql" else "id INTEGER PRIMARY KEY"
+    cur.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS `notif_jobs` (
+            {id_column},
+            circular_id INT NOT NULL,
+            category VARCHAR(32) NOT NULL,
+            title TEXT NOT NULL,
+            link TEXT NOT NULL,
+            state VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            created_at DATETIME NOT NULL
+        )
+        """
+    )
+    _create_index(cur, method, "idx_notif_jobs_state", "notif_jobs", "state")
+
+    # recipient_id is the channel id for guilds and the user id for DMs.
+    # state is one of pending, sent, failed (retried until attempts runs out) and removed (unsubscribed)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `notif_recipients` (
+            job_id INT NOT NULL,
+            type VARCHAR(16) NOT NULL,
+            recipient_id BIGINT UNSIGNED NOT NULL,
+            guild_id BIGINT UNSIGNED,
+            message TEXT,
+            state VARCHAR(16) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (job_id, type, recipient_id)
+        )
+        """
+    )
+
+
+def _migration_bot_state(cur, method: str):
+    # Small JSON values the bot keeps between restarts, like the last member count
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS `bot_state` (
+            name VARCHAR(64) NOT NULL PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """
+    )
+
+
+def _migration_notification_retries(cur, method: str):
+    # The unix time a job may run again at, so the worker can move on to other jobs instead of waiting for a retry
+    _add_column(cur, method, "notif_jobs", "next_attempt_at", "DOUBLE NOT NULL DEFAULT 0")
+
+
+# (version, description, migration). Append new migrations at the end, and never change ones that were released.
+MIGRATIONS = [
+    (1, "Create the tables", _migration_baseline),
+    (2, "Index notification messages by circular", _migration_notif_msgs_index),
+    (3, "Make dm_notify.user_id unique", _migration_unique_dm_notify),
+    (4, "Add log categories and index the logs", _migration_logs_category),
+    (5, "Create the circular checker's table", _migration_checker_cache),
+    (6, "Create the notification job tables", _migration_notification_jobs),
+    (7, "Create the bot state table", _migration_bot_state),
+    (8, "Schedule notification job retries", _migration_notification_retries),
+]
+
+
+def init_database():
+    """Bring the database schema up to date by applying the migrations it hasn't seen yet."""
+    method = "mysql" if storage_method == "mysql" else "sqlite"
+
+    with db_connection() as (_con, _cur):
+        _cur.execute("CREATE TABLE IF NOT EXISTS `schema_version` (version INT NOT NULL)")
+        _cur.execute("SELECT MAX(version) FROM schema_version")
+        current_version = _cur.fetchone()[0] or 0
+
+        for version, description, migration in MIGRATIONS:
+            if version <= current_version:
+                continue
+
+            # MySQL commits DDL statements right away, so the version is recorded after every migration
+            console.info(f"Migrating the database to version {version}: {description}")
+            migration(_cur, method)
+            _cur.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            _con.commit()
+
+
+async def get_bot_state(name: str, default=None):
+    """Get a value saved with set_bot_state(), or default if there is none."""
+    row = await db_fetchone("SELECT value FROM bot_state WHERE name = ?", (name,))
+    return json.loads(row[0]) if row is not None else default
+
+
+async def set_bot_state(name: str, value):
+    """Save a JSON serializable value that is kept between restarts."""
+    await db_execute("REPLACE INTO bot_state (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+
+class CircularBot(commands.Bot):
+    """The bot, which also owns the lifetime of the shared API session and the metrics server."""
+
+    async def start(self, *args, **kwargs):
+        await open_http_session()
+        await start_metrics_server()
+        self._warm_up = asyncio.create_task(self.warm_up())
+        await super().start(*args, **kwargs)
+
+    async def invoke_application_command(self, ctx):
+        with timed_operation("command", ctx.command.qualified_name):
+            await super().invoke_application_command(ctx)
+
+    async def warm_up(self):
+        await refresh_categories()
+        await build_circular_index()
+
+    async def close(self):
+        await super().close()
+        await close_http_session()
+        await stop_metrics_server()
+
+
+client = CircularBot(help_command=None)
+
+metrics.gauge("bot_guilds", "The number of servers the bot is in.", lambda: len(client.guilds))
+metrics.gauge("bot_latency_seconds", "The latency of the discord gateway.", lambda: client.latency)
+
+console.debug("Owner IDs: " + str(owner_ids))
+console.debug("Owner Guilds: " + str(owner_guilds))
+console.debug("Ignored Circulars: " + str(ignored_circulars))
+
+
+async def gather_categories(coro_func, _categories) -> list[tuple[str, object]]:
+    """
+    Run coro_func(category) for every category concurrently, with at most category_concurrency requests in flight.
+    Returns (category, result) pairs in the order of _categories. Categories that fail or return None are logged
+    and left out, so one broken category doesn't take the others down with it.
+    """
+    semaphore = asyncio.Semaphore(api_category_concurrency)
+
+    async def run(category):
+        async with semaphore:
+            return await coro_func(category)
+
+    results = await asyncio.gather(*(run(category) for category in _categories), return_exceptions=True)
+
+    gathered = []
+    for category, result in zip(_categories, results):
+        if isinstance(result, BaseException):
+            console.error(f"Error while getting data for category {category}. Error: {result}")
+            continue
+        if result is None:
+            console.warning(f"Got no data for category {category}.")
+            continue
+        gathered.append((category, result))
+
+    return gathered
+
+
+class CircularIndex:
+    """
+    An in-memory search index of every circular, so searches don't need the API.
+    Titles go into an inverted word index and a trigram index (for typos and partial words), and circulars can be
+    looked up by id. Each category is indexed from its list (see get_circular_list()) and new circulars are added
+    as the checker finds them.
+    """
+    min_similarity = 0.5  # The share of the query's trigrams a title needs to be a fuzzy match
+
+    def __init__(self):
+        self.circulars: dict[int, dict] = {}
+        self._words: dict[str, set[int]] = {}
+        self._trigrams: dict[str, set[int]] = {}
+        self._category_ids: dict[str, set[int]] = {}
+        self._lists: dict[str, object] = {}  # The last list indexed for each category
+        self._prefix_keys: list[str] | None = None  # The sorted words and ids, for prefix lookups with bisect
+
+    @property
+    def ready(self) -> bool:
+        """Whether every category has been indexed at least once."""
+        return bool(categories) and all(category in self._lists for category in categories)
+
+    @staticmethod
+    def words(text: str) -> set[str]:
+        return set(re.findall(r"\w+", text.lower()))
+
+    @classmethod
+    def trigrams(cls, text: str) -> set[str]:
+        trigrams = set()
+        for word in cls.words(text):
+            word = f" {word} "
+            trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+        return trigrams
+
+    def _link(self, index: dict, keys: set[str], id_: int):
+        self._prefix_keys = None
+        for key in keys:
+            index.setdefault(key, set()).add(id_)
+
+    def _unlink(self, index: dict, keys: set[str], id_: int):
+        self._prefix_keys = None
+        for key in keys:
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(id_)
+                if not ids:
+                    del index[key]
+
+    def add(self, circular: dict, category: str):
+        id_ = int(circular['id'])
+        old = self.circulars.get(id_)
+
+        if old is not None:
+            if old['title'] == circular['title'] and old['link'] == circular['link']:
+                self._category_ids.setdefault(category, set()).add(id_)
+                return
+            self._unlink(self._words, self.words(old['title']), id_)
+            self._unlink(self._trigrams, self.trigrams(old['title']), id_)
+
+        # The same fields the search endpoint returns
+        self.circulars[id_] = {'title': circular['title'], 'link': circular['link'], 'id': circular['id']}
+        self._link(self._words, self.words(circular['title']), id_)
+        self._link(self._trigrams, self.trigrams(circular['title']), id_)
+        self._category_ids.setdefault(category, set()).add(id_)
+
+    def remove(self, id_: int):
+        circular = self.circulars.pop(id_, None)
+        if circular is None:
+            return
+
+        self._unlink(self._words, self.words(circular['title']), id_)
+        self._unlink(self._trigrams, self.trigrams(circular['title']), id_)
+        for ids in self._category_ids.values():
+            ids.discard(id_)
+
+    def update_category(self, category: str, circular_list):
+        """Index the list of a category. Does nothing if this exact list (eg. a cached response) was already indexed."""
+        if self._lists.get(category) is circular_list:
+            return
+
+        new_ids = {int(circular['id']) for circular in circular_list}
+        old_ids = self._category_ids.get(category, set()) - new_ids
+        self._category_ids[category] = set()
+
+        for circular in circular_list:
+            self.add(circular, category)
+
+        # Circulars that are no longer listed, unless another category still lists them
+        for id_ in old_ids:
+            if not any(id_ in ids for ids in self._category_ids.values()):
+                self.remove(id_)
+
+        self._lists[category] = circular_list
 
-def send_api_request(url: str, params: dict = None, fallback=False) -> dict | None:
-    try:
-        console.debug(f"Sending API request to {url} with params: {params}")
-        response = requests.get(url, params=params, timeout=5)
-        data = response.json()
-        console.debug(f"Received successful response from {url}")
-        return data['data']
-    except requests.exceptions.Timeout:
-        if fallback:
-            console.error(f"API request to {url} timed out. Fallback also timed out.")
-            return None
-        else:
-            console.warning(f"API request to {url} timed out. Trying fallback API.")
-            return send_api_request(fallback_api_url + url.split(base_api_url)[1], params, True)
-    except requests.exceptions.RequestException as e:
-        if fallback:
-            console.error(f"Error while connecting to the API at {url}. Error: {e}")
-            return None
-        else:
-            console.warning(f"Error while connecting to the API at {url}. Trying fallback API. Error: {e}")
-            return send_api_request(fallback_api_url + url.split(base_api_url)[1], params, True)
+    def search(self, query: str | int, amount: int = 3) -> list[dict]:
+        """The circulars best matching the query, by matching words and then trigram similarity, newest first on ties."""
+        query = str(query).strip()
 
+        if query.isdigit() and int(query) in self.circulars:
+            return [self.circulars[int(query)]]
 
-categories = send_api_request(base_api_url + "categories")
-if categories is None:
-    console.critical("Could not get categories from the API. Exiting.")
-    sys.exit(1)
+        scores = Counter()
+        for word in self.words(query):
+            for id_ in self._words.get(word, ()):
+                scores[id_] += 1
 
+        trigrams = self.trigrams(query)
+        shared = Counter()
+        for trigram in trigrams:
+            for id_ in self._trigrams.get(trigram, ()):
+                shared[id_] += 1
 
+        for id_, count in shared.items():
+            similarity = count / len(trigrams)
+            if similarity >= self.min_similarity or id_ in scores:
+                scores[id_] += similarity
 
-def init_database():
-    # Check the database and verify if all required tables are there
-    _con, _cur = get_db()
+        best = sorted(scores, key=lambda id_: (scores[id_], id_), reverse=True)[:amount]
+        return [self.circulars[id_] for id_ in best]
 
-    # Create table DM Notify
-    _cur.execute(
-        "CREATE TABLE IF NOT EXISTS `dm_notify` (user_id BIGINT UNSIGNED NOT NULL, message TEXT "
-        "DEFAULT 'A new Circular was just posted on the website!' )"
-    )
+    def _with_prefix(self, prefix: str) -> set[int]:
+        """The ids of circulars with a title word (or id) starting with prefix."""
+        if self._prefix_keys is None:
+            # Rebuilt lazily, so indexing a whole list only sorts once
+            self._prefix_keys = sorted(set(self._words) | {str(id_) for id_ in self.circulars})
 
-    # Create table guild notify
-    _cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS `guild_notify` (
-            guild_id BIGINT UNSIGNED NOT NULL UNIQUE,
-            channel_id BIGINT UNSIGNED UNIQUE,
-            message TEXT DEFAULT 'There''s a new circular up on the website!'
-        );
-    """
-    )
+        ids = set()
+        start = bisect.bisect_left(self._prefix_keys, prefix)
+        for key in self._prefix_keys[start:]:
+            if not key.startswith(prefix):
+                break
+            ids.update(self._words.get(key, ()))
+            if key.isdigit() and int(key) in self.circulars:
+                ids.add(int(key))
+        return ids
 
-    _cur.execute(
+    def complete(self, text: str, amount: int = 25) -> list[dict]:
         """
-        CREATE TABLE IF NOT EXISTS `notif_msgs` ( 	
-            circular_id	INT NOT NULL, 	
-            type	TEXT NOT NULL, 	
-            msg_id	BIGINT UNSIGNED NOT NULL UNIQUE, 	
-            channel_id	BIGINT UNSIGNED, 	
-            guild_id	BIGINT UNSIGNED 
-        )
+        The newest circulars where every word of text starts a word of the title (or the id), for autocompletion.
+        The last word is usually still being typed, so all of them are matched as prefixes.
         """
-    )
+        ids = None
+        for word in re.findall(r"\w+", text.lower()):
+            matches = self._with_prefix(word)
+            ids = matches if ids is None else ids & matches
+            if not ids:
+                return []
 
-    sql = """
-            CREATE TABLE IF NOT EXISTS `logs` (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                timestamp DATETIME NOT NULL,
-                level VARCHAR(50) NOT NULL,
-                filename VARCHAR(255) NOT NULL,
-                function_name VARCHAR(255) NOT NULL,
-                line_number INT NOT NULL,
-                thread_name VARCHAR(255) NOT NULL,
-                process_id INT NOT NULL,
-                message TEXT NOT NULL,
-                exception_info TEXT NULL
-            );
-        """
-    _cur.execute(sql)
+        if ids is None:
+            ids = self.circulars.keys()
 
-    _con.commit()
-    _con.close()
+        return [self.circulars[id_] for id_ in sorted(ids, reverse=True)[:amount]]
 
-client = commands.Bot(help_command=None)
+    def stats(self) -> dict:
+        return {'circulars': len(self.circulars), 'words': len(self._words), 'trigrams': len(self._trigrams),
+                'ready': self.ready}
 
-console.debug("Owner IDs: " + str(owner_ids))
-console.debug("Owner Guilds: " + str(owner_guilds))
-console.debug("Ignored Circulars: " + str(ignored_circulars))
+
+circular_index = CircularIndex()
+metrics.gauge("bot_indexed_circulars", "The number of circulars in the search index.",
+              lambda: len(circular_index.circulars))
+
+
+async def build_circular_index():
+    """Index the lists of all categories, so searches can be answered locally."""
+    start = time.perf_counter()
+    await get_all_circular_lists()
+
+    if circular_index.ready:
+        console.info(f"Indexed {len(circular_index.circulars)} circulars in {round(time.perf_counter() - start, 2)}s.")
+    else:
+        console.warning("Could not index the circulars of every category. Searches will use the API until they are.")
+
+
+async def _get_cached_circular_list(category: str) -> list | None:
+    """The list of a category as cached, so it's the same object until the list is fetched again."""
+    data = await cached_api_request("list/" + category)
+    if data is None:
+        return None
+
+    # Only reindexes the category when the list was actually fetched again
+    circular_index.update_category(category, data)
+    return data
 
 
 async def get_circular_list(category: str) -> tuple | None:
-    url = base_api_url + "list/" + category
     if category not in categories:
         raise ValueError(f"Invalid Category. `{category}` was passed in while `{categories}` are valid.")
 
-    data = await send_async_api_request(url)
+    data = await _get_cached_circular_list(category)
+    if data is None:
+        return None
+
     return tuple(data)
 
 
-async def get_latest_circular(category: str) -> dict | None:
-    url = base_api_url + "latest/"
+async def get_all_circular_lists() -> list:
+    """Get the circulars of all categories, merged and sorted by circular ID (newest first)."""
+    merged = []
+
+    for _, circular_list in await gather_categories(get_circular_list, categories):
+        merged += circular_list
+
+    # sort() is stable, so circulars with the same ID stay in category order
+    merged.sort(key=lambda x: x['id'], reverse=True)
+    return merged
+
+
+def build_circular_list_pages(circular_list, title: str) -> list[Embed]:
+    """The /circular list pages of the circulars, 10 per page. Ignored circulars are left out."""
+    ignored = set(ignored_circulars)
+    circular_list = [i for i in circular_list if i['id'] not in ignored]
+    page_count = math.ceil(len(circular_list) / 10)
+
+    pages = []
+    for page in range(page_count):
+        embed = discord.Embed(title=title, color=embed_color)
+        embed.set_footer(text=embed_footer)
+        embed.set_author(name=embed_title)
+        embed.description = f"Format - `[ID] Circular Title`\nPage **{page + 1}**\n"
+
+        for number, item in enumerate(circular_list[page * 10:page * 10 + 10], page * 10 + 1):
+            embed.add_field(name=f"**{number}**. [{item['id']}]  `{item['title'].strip()}`", value=f"{item['link']}",
+                            inline=False)
+        pages.append(embed)
+
+    return pages
+
+
+# category (or "all") -> (the cached lists the pages were built from, the pages)
+circular_list_pages: dict[str, tuple[tuple, list[Embed]]] = {}
+
+
+async def get_circular_list_pages(category: str) -> list[Embed] | None:
+    """
+    The /circular list pages of a category, or of all of them merged.
+    They're built once for each version of the cached lists and reused until one of them is fetched again.
+    """
+    if category == "all":
+        gathered = await gather_categories(_get_cached_circular_list, categories)
+    elif category in categories:
+        data = await _get_cached_circular_list(category)
+        gathered = [(category, data)] if data is not None else []
+    else:
+        raise ValueError(f"Invalid Category. `{category}` was passed in while `{categories}` and `all` are valid.")
+
+    if not gathered:
+        return None
+
+    sources = tuple(data for _, data in gathered)
+    cached = circular_list_pages.get(category)
+    if cached is not None and len(cached[0]) == len(sources) and all(a is b for a, b in zip(cached[0], sources)):
+        return cached[1]
 
-    # If the latest between all categories is requested
     if category == "all":
-        latest_circular = []
+        merged = [circular for data in sources for circular in data]
+        merged.sort(key=lambda x: x['id'], reverse=True)
+        pages = build_circular_list_pages(merged, "Circular List | All Categories")
+    else:
+        pages = build_circular_list_pages(sources[0], f"Circular List | `{category.capitalize()}`")
+
+    circular_list_pages[category] = (sources, pages)
+    console.debug(f"Built {len(pages)} list pages for {category}")
+    return pages
 
+
+async def get_latest_circular(category: str) -> dict | None:
+    # If the latest between all categories is requested
+    if category == "all":
         # Get the latest circulars of each category
-        for category in categories:
-            async with aiohttp.ClientSession(timeout=10) as session:
-                data = await send_async_api_request(url + category)
-                latest_circular.append(data)
+        latest_circulars = await gather_categories(lambda _category: cached_api_request("latest/" + _category), categories)
+
+        if not latest_circulars:
+            return None
 
         # Get the circular with the highest ID in the latest circulars of each category
-        latest_circular = max(latest_circular, key=lambda element: element['id'])
+        latest_circular = max((data for _, data in latest_circulars), key=lambda element: element['id'])
 
     # If the latest circular of a valid category is requested
     elif category in categories:
-        data = await send_async_api_request(url + category)
+        data = await cached_api_request("latest/" + category)
         latest_circular = data
 
     else:
@@ -330,130 +1813,657 @@ async def get_latest_circular(category: str) -> dict | None:
     return latest_circular
 
 
-async def get_png(download_url: str) -> tuple | None:
-    url = base_api_url + "getpng"
-    params = {'url': download_url}
+async def get_cached_png(download_url: str) -> tuple | None:
+    """Get the page image URLs of a circular from the png_cache table."""
+    res = await db_fetchone("SELECT png_urls FROM png_cache WHERE link = ?", (download_url,))
 
-    data = await send_async_api_request(url, params)
-    return tuple(data)
+    if res is None:
+        return None
+
+    return tuple(json.loads(res[0]))
+
+
+async def cache_png(download_url: str, png_urls: tuple, circular_id: int = None):
+    """Save the page image URLs of a circular to the png_cache table."""
+    await db_execute(
+        "REPLACE INTO png_cache (link, circular_id, png_urls) VALUES (?, ?, ?)",
+        (download_url, circular_id, json.dumps(list(png_urls)))
+    )
+
+
+async def invalidate_png_cache(circular_id: int = None, download_url: str = None) -> int:
+    """
+    Remove the cached page images of a circular (by ID or link), or of all circulars if neither is passed.
+    Returns the number of removed entries.
+    """
+    if circular_id is not None:
+        removed = await db_execute("DELETE FROM png_cache WHERE circular_id = ?", (circular_id,))
+    elif download_url is not None:
+        removed = await db_execute("DELETE FROM png_cache WHERE link = ?", (download_url,))
+    else:
+        removed = await db_execute("DELETE FROM png_cache")
+
+    # The in-memory cache can't be searched by circular ID, so drop all of its page images
+    api_cache.invalidate("getpng")
+
+    return removed
+
+
+async def get_png(download_url: str, circular_id: int = None) -> tuple | None:
+    async def fetch():
+        # Circulars don't change once posted, so their rendered pages can be reused
+        png_urls = await get_cached_png(download_url)
+        if png_urls:
+            console.debug(f"Got the page images of {download_url} from the PNG cache")
+            metrics.inc("bot_cache_requests_total", cache="png", result="hit")
+            return png_urls
+
+        metrics.inc("bot_cache_requests_total", cache="png", result="miss")
+
+        params = {'url': download_url}
+
+        data = await cached_api_request("getpng", params)
+        if not data:
+            return None
+
+        await cache_png(download_url, data, circular_id)
+        return tuple(data)
+
+    # Everyone asking for the same circular at once shares one lookup
+    return await api_single_flight.do(("png", download_url), fetch)
 
 
 async def search(query: str | int, amount: int = 3) -> tuple | None:
-    url = base_api_url + "search"
+    # The API is only needed until every category is indexed
+    if circular_index.ready:
+        metrics.inc("bot_searches_total", source="index")
+        return tuple(circular_index.search(query, amount)) or None
+
+    metrics.inc("bot_searches_total", source="api")
+
     params = {'query': query, "amount": amount}
 
-    data = await send_async_api_request(url, params)
+    data = await cached_api_request("search", params)
+    if data is None:
+        return None
+
     return tuple(data)
 
 
-async def send_to_guilds(
-        guilds: list, channels: list, messages: list, notif_msgs: dict, embed_list: tuple[discord.Embed],
-        error_embed: discord.Embed, id_: int
-):
-    con, cur = get_db()
-    embed = embed_list[0]
-    for guild, channel, message in zip(guilds, channels, messages):  # For each guild in the database
+class CircularChecker:
+    """
+    Async replacement for pybpsapi's CircularChecker, using the shared session and the database threads, so polling
+    never blocks the event loop. The id of the latest circular is kept in the same `cache` table pybpsapi used.
+    Requests are conditional, so an unchanged API answers with an empty 304.
+    """
 
-        # Set the custom message if there is one
-        console.debug(f"Message: {message}")
-        embed.description = message
+    def __init__(self, db_table: str = "cache"):
+        self.db_table = db_table
+        self.category = "None"  # pybpsapi saved the checker for all categories under this name
+        self._latest_id: int | None = None
+        self._loaded = False
+        self._unsaved_id: int | None = None
+        self._endpoint = None
+        self._validators = {}
+
+    async def get_cache(self) -> int | None:
+        if not self._loaded:
+            row = await db_fetchone(f"SELECT latest_circular_id FROM {self.db_table} WHERE category = ?",
+                                    (self.category,))
+            self._latest_id = int(row[0]) if row is not None and row[0] is not None else None
+            self._loaded = True
+
+        return self._latest_id
+
+    async def _set_cache(self, circular_id: int):
+        await db_execute(f"REPLACE INTO {self.db_table} (category, latest_circular_id) VALUES (?, ?)",
+                         (self.category, circular_id))
+        self._latest_id = circular_id
+
+    async def save(self):
+        if self._unsaved_id is not None:
+            await self._set_cache(self._unsaved_id)
+            self._unsaved_id = None
+
+    async def check(self, save: bool = True) -> list[dict]:
+        """
+        Returns the circulars posted since the last check, oldest first. The first check only saves the latest.
+        With save=False, the latest id is only saved by save(), so the circulars are reported again if that never
+        happens (e.g. the bot crashes before they are handled).
+        """
+        cached_id = await self.get_cache()
+        endpoint = f"new-circulars/{cached_id}" if cached_id is not None else "new-circulars/"
+
+        # Validators only apply to the URL they came from
+        if endpoint != self._endpoint:
+            self._endpoint = endpoint
+            self._validators = {}
+
+        status, res = await _send_api_request(endpoint, validators=self._validators)
+        if status != 200 or not res:
+            return []
+
+        # The API sorts them newest first
+        if cached_id is None:
+            await self._set_cache(int(res[0]['id']))
+            return []
+
+        self._unsaved_id = int(res[0]['id'])
+        if save:
+            await self.save()
 
-        # Try to fetch the guild and channel from the discord API
+        res.reverse()
+        return res
+
+
+class RateLimiter:
+    """
+    Client-side pacing for the requests notifications make to discord through py-cord's HTTP client, which handles the
+    per route buckets (keyed by X-RateLimit-Bucket) and retries 429s itself.
+    A token bucket of `rate` requests per second keeps all of them under discord's global limit, so that they wait for
+    their turn instead of running into 429s. When it runs dry, guild channels get the free tokens before DMs.
+    The rate adapts: every 429 py-cord reports halves it (down to a tenth of max_rate), and after the retry-after has
+    passed, every successful request raises it by 1% of max_rate again.
+    Also counts the 429s, the time discord told py-cord to wait, and the effective sends per second, in `metrics` too.
+    """
+    GUILD, DM = 0, 1  # Priorities, lower goes first
+    MIN_RATE_FRACTION = 0.1
+    RECOVERY_STEP = 0.01
+
+    def __init__(self, max_rate: float):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self._tokens = max_rate
+        self._refilled_at = 0.0
+        self._waiting = [0, 0]  # Callers waiting for a token, per priority
+        self._recent_sends = deque(maxlen=1000)
+        self._slowed_until = 0.0  # The rate isn't raised again before this
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.global_rate_limited = 0
+        self.retry_after_total = 0.0
+        self.wait_total = 0.0
+
+    async def wait(self, priority: int = GUILD):
+        """Wait until a request can be made."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        if self.rate > 0:
+            await self._wait_for_token(priority, loop)
+
+        waited = loop.time() - start
+        self.wait_total += waited
+        self.requests += 1
+        metrics.inc("bot_discord_limiter_wait_seconds_total", waited)
+
+    async def _wait_for_token(self, priority: int, loop):
+        self._waiting[priority] += 1
         try:
-            guild = await client.fetch_guild(int(guild))
-            channel = await guild.fetch_channel(int(channel))
+            while True:
+                now = loop.time()
+                self._tokens = min(self.rate, self._tokens + (now - self._refilled_at) * self.rate)
+                self._refilled_at = now
+
+                # Leave the token for a caller of a higher priority if there is one
+                if self._tokens >= 1 and not any(self._waiting[:priority]):
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep(max(1 - self._tokens, 0.5) / self.rate)
+        finally:
+            self._waiting[priority] -= 1
+
+    def sent(self):
+        """Count a successful request, and raise the rate back towards max_rate if it was lowered."""
+        now = time.monotonic()
+        self._recent_sends.append(now)
+
+        if self.rate < self.max_rate and now >= self._slowed_until:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.RECOVERY_STEP)
+
+    def rate_limit_hit(self, retry_after: float):
+        """Count a 429 and lower the rate."""
+        self.rate_limited += 1
+        self.retry_after_total += retry_after
+        metrics.inc("bot_discord_rate_limited_total")
+        metrics.inc("bot_discord_retry_after_seconds_total", retry_after)
+
+        if self.max_rate > 0:
+            self.rate = max(self.max_rate * self.MIN_RATE_FRACTION, self.rate / 2)
+            self._slowed_until = time.monotonic() + retry_after
+            console.warning(f"Hit a discord rate limit. Lowered the notification rate to {self.rate:.1f}/s")
+
+    def global_rate_limit_hit(self):
+        """Count a 429 that was for the global rate limit. rate_limit_hit() was already called for it."""
+        self.global_rate_limited += 1
+        metrics.inc("bot_discord_global_rate_limited_total")
+
+    def sends_per_second(self, window: float = 10) -> float:
+        """The number of successful requests per second over the last `window` seconds."""
+        since = time.monotonic() - window
+        return sum(1 for sent_at in self._recent_sends if sent_at >= since) / window
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'rate': round(self.rate, 2),
+            'rate_limited': self.rate_limited,
+            'global_rate_limited': self.global_rate_limited,
+            'retry_after_total': round(self.retry_after_total, 2),
+            'wait_total': round(self.wait_total, 2),
+            'sends_per_second': round(self.sends_per_second(), 2),
+        }
 
-        # If the channel or guild is not found (deleted)
-        except discord.NotFound:
-            if type(guild) is not int:
-                guild = guild.id
 
-            console.warning(
-                f"Guild or channel not found. Guild: {guild}, Channel: {channel}. "
-                "Seems like I was kicked from the server. Deleting from DB"
+class RateLimitLogHandler(logging.Handler):
+    """
+    Reports the 429s py-cord's HTTP client runs into to a RateLimiter, from the warnings it logs for them. Every 429
+    logs a "We are being rate limited" warning, and global ones log a "Global rate limit" warning after it.
+    """
+
+    def __init__(self, limiter: RateLimiter):
+        super().__init__(logging.WARNING)
+        self.limiter = limiter
+
+    def emit(self, record):
+        if not isinstance(record.msg, str) or not record.args:
+            return
+
+        if record.msg.startswith("We are being rate limited"):
+            self.limiter.rate_limit_hit(float(record.args[0]))
+        elif record.msg.startswith("Global rate limit"):
+            self.limiter.global_rate_limit_hit()
+
+
+# Shared by guild and DM deliveries, so that running both at once stays under Discord's global rate limit
+rate_limiter = RateLimiter(notify_max_rate)
+logging.getLogger("discord.http").addHandler(RateLimitLogHandler(rate_limiter))
+metrics.gauge("bot_discord_send_rate", "The rate notifications are currently paced at, in requests per second.",
+              lambda: rate_limiter.rate)
+metrics.gauge("bot_discord_sends_per_second", "Successful notification requests per second over the last 10 seconds.",
+              rate_limiter.sends_per_second)
+
+
+async def send_embeds(channel_id: int, embeds: list[dict], priority: int = RateLimiter.GUILD) -> dict:
+    """
+    Send a message with the (already converted) embeds to a channel with py-cord's HTTP client, after waiting for
+    rate_limiter. Returns the message data discord responded with.
+    """
+    await rate_limiter.wait(priority)
+
+    start = time.perf_counter()
+    try:
+        data = await client.http.send_message(channel_id, None, embeds=embeds)
+    finally:
+        record_time("discord", time.perf_counter() - start)
+
+    rate_limiter.sent()
+    return data
+
+
+async def fan_out(targets, worker, label: str, workers: int = None, progress=None) -> dict:
+    """
+    Run worker(target) for every target with a bounded pool of concurrent workers, logging progress and throughput.
+    targets can be a regular or an async iterable. worker returns "failed" for a target it couldn't deliver to and
+    "skipped" for one it left out (eg. a subscriber that is gone), anything else counts as done. Exceptions are
+    logged and count as failed. Returns the number of targets done, failed and skipped, and the throughput.
+    progress is an optional coroutine function that is also given the stats with every progress update.
+    Workers that talk to discord are paced by rate_limiter, for every request they make.
+    """
+    workers = workers or notify_workers
+    if workers < 1:
+        raise ValueError(f"fan_out needs at least 1 worker, got {workers}")
+
+    queue = asyncio.Queue(maxsize=workers * 2)
+    stats = {'done': 0, 'failed': 0, 'skipped': 0}
+    start = time.monotonic()
+
+    async def producer():
+        try:
+            if hasattr(targets, '__aiter__'):
+                async for target in targets:
+                    await queue.put(target)
+            else:
+                for target in targets:
+                    await queue.put(target)
+        finally:
+            # One stop signal for each worker
+            for _ in range(workers):
+                await queue.put(None)
+
+    async def consumer():
+        while (target := await queue.get()) is not None:
+            try:
+                outcome = await worker(target)
+            except Exception as e:
+                console.error(f"[{label}] Error while delivering to {target}: {e}")
+                outcome = "failed"
+
+            stats[outcome if outcome in ("failed", "skipped") else "done"] += 1
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(notify_progress_interval)
+            elapsed = time.monotonic() - start
+            console.info(
+                f"[{label}] Delivered {stats['done']} ({stats['failed']} failed, {stats['skipped']} skipped) "
+                f"in {elapsed:.0f}s, {stats['done'] / elapsed:.1f}/s"
             )
-            cur.execute(
-                "DELETE FROM guild_notify WHERE guild_id = ? AND channel_id = ?",
-                (guild, channel)
+
+            if progress is not None:
+                try:
+                    await progress(stats)
+                except Exception as e:
+                    console.warning(f"[{label}] Error while reporting progress: {e}")
+
+    reporting = asyncio.create_task(reporter())
+    tasks = [asyncio.create_task(producer()), *(asyncio.create_task(consumer()) for _ in range(workers))]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        # The targets couldn't be read to the end. The workers still finish the ones that are already queued (the
+        # producer stops them after those), so that none are delivered after this returns and go unrecorded
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        reporting.cancel()
+
+    stats['elapsed'] = time.monotonic() - start
+    stats['rate'] = stats['done'] / stats['elapsed'] if stats['elapsed'] else 0.0
+    console.info(
+        f"[{label}] Finished. Delivered {stats['done']} ({stats['failed']} failed, {stats['skipped']} skipped) "
+        f"in {stats['elapsed']:.1f}s, {stats['rate']:.1f}/s"
+    )
+
+    return stats
+
+
+class EmbedPayloads:
+    """
+    The embeds of a circular notification, converted to the dicts discord's API takes once and shared by every
+    recipient. The first embed's description is the recipient's custom message, so there's one list of embeds for each
+    of the (few) distinct messages, the most recently used `max_messages` of which are kept.
+    """
+
+    def __init__(self, embed_list: list[discord.Embed], max_messages: int = 256):
+        self.max_messages = max_messages
+        self._embeds = [embed.to_dict() for embed in embed_list]
+        self._payloads: OrderedDict[str | None, list[dict]] = OrderedDict()
+
+    def get(self, message: str | None) -> list[dict]:
+        payload = self._payloads.get(message)
+
+        if payload is None:
+            first = self._embeds[0].copy()
+            if message:
+                first['description'] = message
+            else:
+                first.pop('description', None)
+
+            payload = [first, *self._embeds[1:]]
+            self._payloads[message] = payload
+            if len(self._payloads) > self.max_messages:
+                self._payloads.popitem(last=False)
+        else:
+            self._payloads.move_to_end(message)
+
+        return payload
+
+
+class NotificationWriter:
+    """
+    Buffers the database writes of a notification run (sent messages, removed subscribers and, for notification jobs,
+    the state of each recipient) and saves them in bulk.
+    The buffer is written in one transaction every `batch_size` records, every `interval` seconds and when the run
+    ends, so a crash loses at most one batch of records. If a write fails, the batch is kept and retried with the
+    next one. Rows the database rejects (eg. a duplicate message id) are saved one by one instead, so only those are
+    dropped. Use it as an async context manager.
+    """
+    queries = {
+        'guild_msgs': "INSERT INTO notif_msgs (circular_id, msg_id, type, channel_id, guild_id) VALUES (?, ?, ?, ?, ?)",
+        'dm_msgs': "INSERT INTO notif_msgs (circular_id, msg_id, type, channel_id) VALUES (?, ?, ?, ?)",
+        'removed_guilds': "DELETE FROM guild_notify WHERE guild_id = ? AND channel_id = ?",
+        'removed_users': "DELETE FROM dm_notify WHERE user_id = ?",
+        'recipient_states': "UPDATE notif_recipients SET state = ?, attempts = attempts + 1 "
+                            "WHERE job_id = ? AND type = ? AND recipient_id = ?",
+    }
+
+    def __init__(self, circular_id: int, job_id: int = None, batch_size: int = None, interval: float = None):
+        self.circular_id = circular_id
+        self.job_id = job_id
+        self.batch_size = batch_size or notify_write_batch_size
+        self.interval = interval or notify_write_interval
+        self.written = 0
+        self.dropped = 0
+        self._buffers = {name: [] for name in self.queries}
+        self._pending = 0
+        self._retry_at = 0.0
+        self._flusher = None
+
+    async def __aenter__(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._flusher.cancel()
+
+        try:
+            await self.flush()
+        except Exception:
+            console.error(f"[NotificationWriter] Lost {self._pending} records for circular {self.circular_id}")
+            raise
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                console.error(f"[NotificationWriter] Error while saving to the database: {e}")
+
+    async def _add(self, buffer: str, row: tuple):
+        self._buffers[buffer].append(row)
+        self._pending += 1
+
+        # After a failed write, only the periodic flush retries until the interval has passed
+        if self._pending >= self.batch_size and time.monotonic() >= self._retry_at:
+            try:
+                await self.flush()
+            except Exception as e:
+                console.error(f"[NotificationWriter] Error while saving to the database: {e}")
+
+    async def add_guild_message(self, msg_id: int, channel_id: int, guild_id: int):
+        await self._add('guild_msgs', (self.circular_id, msg_id, "guild", channel_id, guild_id))
+
+    async def add_dm_message(self, msg_id: int, user_id: int):
+        await self._add('dm_msgs', (self.circular_id, msg_id, "dm", user_id))
+
+    async def remove_guild(self, guild_id: int, channel_id: int):
+        await self._add('removed_guilds', (guild_id, channel_id))
+
+    async def remove_user(self, user_id: int):
+        await self._add('removed_users', (user_id,))
+
+    async def set_recipient_state(self, type_: str, recipient_id: int, state: str):
+        """Record the outcome of a delivery attempt to a recipient of the notification job."""
+        await self._add('recipient_states', (state, self.job_id, type_, recipient_id))
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        # Swap the buffers out before awaiting, so records added meanwhile go into the next batch
+        buffers, pending = self._buffers, self._pending
+        self._buffers = {name: [] for name in self.queries}
+        self._pending = 0
+
+        def write(con, cur) -> int:
+            try:
+                for name, rows in buffers.items():
+                    if rows:
+                        cur.executemany(self.queries[name], rows)
+                con.commit()
+                return 0
+            except db_integrity_errors as e:
+                con.rollback()
+                console.warning(f"[NotificationWriter] Could not save a batch ({e}). Saving its records one by one.")
+            except Exception:
+                con.rollback()
+                raise
+
+            # A rejected row only fails its own statement, the rest of the transaction goes on
+            dropped = 0
+            try:
+                for name, rows in buffers.items():
+                    for row in rows:
+                        try:
+                            cur.execute(self.queries[name], row)
+                        except db_integrity_errors as e:
+                            dropped += 1
+                            console.error(f"[NotificationWriter] Dropped {name} record {row}: {e}")
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+            return dropped
+
+        try:
+            dropped = await run_db(write)
+        except Exception:
+            # Put the batch back in front of the records added meanwhile, so the next flush retries it
+            for name, rows in buffers.items():
+                self._buffers[name][:0] = rows
+            self._pending += pending
+            self._retry_at = time.monotonic() + self.interval
+            raise
+
+        self.written += pending - dropped
+        self.dropped += dropped
+        if dropped:
+            console.warning(
+                f"[NotificationWriter] Dropped {dropped} of {pending} records for circular {self.circular_id}"
             )
-            con.commit()
-            continue
+        console.debug(f"[NotificationWriter] Saved {pending - dropped} records for circular {self.circular_id}")
 
-        except discord.Forbidden:  # TODO find out if this can even happen
-            if type(guild) is not int:
-                guild = guild.id
 
-            console.warning(f"No permission to get guild/channel. Guild: {guild}, Channel: {channel}.")
-            continue
+# What fan_out() counts each delivery state as
+fan_out_outcomes = {"sent": "done", "failed": "failed", "removed": "skipped"}
 
-        except Exception as e:
-            console.error(f"Error: {e}")
-            continue
 
-        # Try to send the message
+async def send_to_guilds(
+        guilds, sent_counts: dict, embeds: "EmbedPayloads", error_embed: discord.Embed, id_: int,
+        job_id: int = None
+):
+    """
+    Send the circular to every guild's notification channel. guilds is a (async) iterable of
+    (guild_id, channel_id, message) and sent_counts["guild"] is increased for every message sent.
+    If it is for a notification job, the outcome for each channel is saved as its recipient state.
+    """
+
+    async def deliver(guild_id: int, channel_id: int, message: str) -> str:
+        console.debug(f"Message: {message}")
+
+        # Send the prepared embeds straight to the channel. A channel that is gone shows up as NotFound here,
+        # so it doesn't have to be looked up first
         try:
-            _msg = await channel.send(embeds=list(embed_list))
-            console.debug(f"Sent Circular Embed to {guild.id} | {channel.id}")
+            data = await send_embeds(channel_id, embeds.get(message))
+            console.debug(f"Sent Circular Embed to {guild_id} | {channel_id}")
+
+        # If the channel is not found (deleted). Being kicked from the server shows up as Forbidden instead
+        except discord.NotFound as e:
+            if e.code != 10003:  # Unknown Channel
+                console.error(f"Couldn't send Circular Embed to {guild_id}'s | {channel_id}. " + str(e))
+                return "failed"
+
+            console.warning(
+                f"Channel not found. Guild: {guild_id}, Channel: {channel_id}. "
+                "Seems like the channel was deleted. Deleting from DB"
+            )
+            await writer.remove_guild(guild_id, channel_id)
+            return "removed"
 
         # If the bot doesn't have permissions to post in the channel
         except discord.Forbidden:
 
             console.warning(
-                    f"Couldn't send Circular to {guild.id}'s {channel.id} due to discord.Forbidden while attempting to send. "
+                    f"Couldn't send Circular to {guild_id}'s {channel_id} due to discord.Forbidden while attempting to send. "
                     f"Deleting from DB.1"
             )
-            cur.execute(
-                "DELETE FROM guild_notify WHERE guild_id = ? AND channel_id = ?",
-                (guild.id, channel.id)
-            )
-            con.commit()
-            continue
+            await writer.remove_guild(guild_id, channel_id)
+            return "removed"
 
         except Exception as e:
             console.error(
-                f"Couldn't send Circular Embed to {guild.id}'s | {channel.id}. Not discord.Forbidden." + str(e))
-            continue
+                f"Couldn't send Circular Embed to {guild_id}'s | {channel_id}. Not discord.Forbidden." + str(e))
+            return "failed"
 
-        try:
-            cur.execute("INSERT INTO notif_msgs (circular_id, msg_id, type, channel_id, guild_id) "
-                        "VALUES (?, ?, ?, ?, ?)", (id_, _msg.id, "guild", channel.id, guild.id))
-            con.commit()
-            notif_msgs["guild"].append((_msg.id, channel.id, guild.id))
-        except Exception as e:
-            console.error(f"Error: {e}")
+        sent_counts["guild"] += 1
+        await writer.add_guild_message(int(data['id']), channel_id, guild_id)
+        return "sent"
+
+    async def send(target):
+        channel_id = int(target[1])
+        state = await deliver(int(target[0]), channel_id, target[2])
+        metrics.inc("bot_notifications_total", type="guild", outcome=state)
+
+        if job_id is not None:
+            await writer.set_recipient_state("guild", channel_id, state)
 
-    con.close()
+        return fan_out_outcomes[state]
 
+    # Sent messages and removed channels are saved in batches instead of one commit per guild
+    async with NotificationWriter(id_, job_id) as writer:
+        await fan_out(guilds, send, "Guilds")
 
-async def send_to_users(user_ids: list, user_messages: list[str], notif_msgs: dict, embed_list: list[Embed],
-                        id_: int):
-    con, cur = get_db()
-    embed = embed_list[0]
 
-    for user_id, message in zip(user_ids, user_messages):
+async def send_to_users(users, sent_counts: dict, embeds: "EmbedPayloads", id_: int, job_id: int = None):
+    """
+    Send the circular to every user in their DMs. users is a (async) iterable of (user_id, message) and
+    sent_counts["dm"] is increased for every message sent.
+    If it is for a notification job, the outcome for each user is saved as their recipient state.
+    """
 
+    async def deliver(user_id: int, message: str) -> str:
+
+        # Get the user and their DM channel from the gateway cache, and only ask the discord API if they aren't there.
+        # New DM channels are cached too, so they are only created once
         try:
-            user = await client.fetch_user(int(user_id))
+            user = client.get_user(user_id)
+            if user is None:
+                start = time.perf_counter()
+                try:
+                    user = await client.fetch_user(user_id)
+                finally:
+                    record_time("discord", time.perf_counter() - start)
+
+            dm_channel = user.dm_channel
+            if dm_channel is None:
+                await rate_limiter.wait(RateLimiter.DM)
+                start = time.perf_counter()
+                try:
+                    dm_channel = await user.create_dm()
+                finally:
+                    record_time("discord", time.perf_counter() - start)
 
         # If the user is not found (deleted)
         except discord.NotFound:
             console.warning(f"discord.NotFound while fetching user `{user_id}` to send notification to. Removed from database")
 
-            cur.execute("DELETE FROM dm_notify WHERE user_id = ?", (user_id,))
-            con.commit()
-            continue
+            await writer.remove_user(user_id)
+            return "removed"
 
         # If there is any other error
         except Exception as e:
             console.error(f"Could get fetch a user {user_id}. Error: {e}")
-            continue
+            return "failed"
 
         console.debug(f"[Listeners] | Message: {message}")
-        embed.description = message
 
-        # Try to send the embed
+        # Try to send the prepared embeds
         try:
-            _msg = await user.send(embeds=list(embed_list))  # Send the embed to the user
+            data = await send_embeds(dm_channel.id, embeds.get(message), RateLimiter.DM)
             console.debug(f"Successfully sent Circular in DMs to {user.name} ({user.display_name}) | {user.id}")
 
         # If their DMs are disabled/bot is blocked
@@ -464,24 +2474,178 @@ async def send_to_users(user_ids: list, user_messages: list[str], notif_msgs: di
             )
 
             # Remove them from database
-            cur.execute("DELETE FROM dm_notify WHERE user_id = ?", (user_id,))
-            con.commit()
-            continue
+            await writer.remove_user(user_id)
+            return "removed"
 
         except Exception as e:
             console.error(f"Couldn't send Circular Embed to User: {user_id}")
             console.error(e)
-            continue
+            return "failed"
+
+        sent_counts["dm"] += 1
+        await writer.add_dm_message(int(data['id']), user_id)
+        return "sent"
+
+    async def send(target):
+        user_id = int(target[0])
+        state = await deliver(user_id, target[1])
+        metrics.inc("bot_notifications_total", type="dm", outcome=state)
+
+        if job_id is not None:
+            await writer.set_recipient_state("dm", user_id, state)
+
+        return fan_out_outcomes[state]
+
+    # Sent messages and removed users are saved in batches instead of one commit per user
+    async with NotificationWriter(id_, job_id) as writer:
+        await fan_out(users, send, "DMs")
+
+
+async def create_notification_job(circular: dict) -> int:
+    """
+    Save a notification job for a new circular, with every current subscriber as a pending recipient.
+    Returns the id of the job, which is the existing one if the circular already has a job.
+    """
+    def create(con, cur):
+        # A circular only gets one job, even if it is reported again after its job was saved
+        cur.execute("SELECT id FROM notif_jobs WHERE circular_id = ?", (int(circular['id']),))
+        if (row := cur.fetchone()) is not None:
+            return row[0]
 
         try:
-            notif_msgs["dm"].append((_msg.id, user.id))
-            cur.execute("INSERT INTO notif_msgs (circular_id, msg_id, type, channel_id) "
-                        "VALUES (?, ?, ?, ?)", (id_, _msg.id, "dm", user_id))
+            cur.execute(
+                "INSERT INTO notif_jobs (circular_id, category, title, link, created_at) VALUES (?, ?, ?, ?, ?)",
+                (int(circular['id']), circular['category'], circular['title'], circular['link'],
+                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            job_id = cur.lastrowid
+
+            # Copied by the database, so the subscriber lists never have to be loaded for this
+            cur.execute(
+                "INSERT INTO notif_recipients (job_id, type, recipient_id, guild_id, message) "
+                "SELECT ?, 'guild', channel_id, guild_id, message FROM guild_notify WHERE channel_id IS NOT NULL",
+                (job_id,)
+            )
+            cur.execute(
+                "INSERT INTO notif_recipients (job_id, type, recipient_id, message) "
+                "SELECT ?, 'dm', user_id, message FROM dm_notify",
+                (job_id,)
+            )
             con.commit()
-        except Exception as e:
-            console.error(f"Error: {e}")
+        except Exception:
+            con.rollback()
+            raise
+
+        return job_id
+
+    return await run_db(create)
+
+
+async def get_next_notification_job() -> tuple | None:
+    """
+    Returns (id, circular_id, category, title, link, attempts) of the oldest job that can run now, or None.
+    Jobs waiting for a retry are left out until their next_attempt_at.
+    """
+    return await db_fetchone(
+        "SELECT id, circular_id, category, title, link, attempts FROM notif_jobs "
+        "WHERE state = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+        (time.time(),)
+    )
+
+
+async def get_notification_job_delay() -> float | None:
+    """Returns the number of seconds until the next job waiting for a retry can run, or None if no job is left."""
+    row = await db_fetchone("SELECT MIN(next_attempt_at) FROM notif_jobs WHERE state = 'pending'")
+
+    if row is None or row[0] is None:
+        return None
+    return max(float(row[0]) - time.time(), 0.0)
+
+
+def stream_notification_recipients(job_id: int, type_: str):
+    """
+    Yield the recipients of a job that still have to be sent to: pending ones, and failed ones with attempts left.
+    Guilds are (guild_id, channel_id, message), users are (user_id, message).
+    """
+    columns = "guild_id, recipient_id, message" if type_ == "guild" else "recipient_id, message"
+
+    return db_stream(
+        f"SELECT {columns} FROM notif_recipients", "recipient_id",
+        "job_id = ? AND type = ? AND state IN ('pending', 'failed') AND attempts < ?",
+        (job_id, type_, notify_max_attempts), key_index=1 if type_ == "guild" else 0
+    )
+
+
+async def count_notification_recipients(job_id: int) -> tuple[int, int]:
+    """Returns how many guilds and users of a job still have to be sent to."""
+    rows = await db_fetchall(
+        "SELECT type, COUNT(*) FROM notif_recipients "
+        "WHERE job_id = ? AND state IN ('pending', 'failed') AND attempts < ? GROUP BY type",
+        (job_id, notify_max_attempts)
+    )
+    counts = dict(rows)
+    return counts.get("guild", 0), counts.get("dm", 0)
+
+
+def stream_subscribers(type_: str):
+    """Yield every subscribed guild as (guild_id, channel_id, message), or every DM user as (user_id, message)."""
+    if type_ == "guild":
+        return db_stream("SELECT guild_id, channel_id, message FROM guild_notify", "guild_id")
+    return db_stream("SELECT user_id, message FROM dm_notify", "user_id")
+
 
-    con.close()
+async def finish_notification_job(job_id: int, state: str = "done"):
+    await db_execute("UPDATE notif_jobs SET state = ? WHERE id = ?", (state, job_id))
+
+
+async def finish_notification_round(job_id: int) -> float | None:
+    """
+    Call after sending a job to its recipients. If some failed and have attempts left, the job is scheduled to run
+    again after a delay that doubles with every attempt, which is returned. Otherwise the job is done and None is
+    returned.
+    """
+    def finish(con, cur):
+        cur.execute(
+            "SELECT MIN(attempts) FROM notif_recipients "
+            "WHERE job_id = ? AND state IN ('pending', 'failed') AND attempts < ?",
+            (job_id, notify_max_attempts)
+        )
+        attempts = cur.fetchone()[0]
+
+        if attempts is None:
+            cur.execute("UPDATE notif_jobs SET state = 'done' WHERE id = ?", (job_id,))
+            delay = None
+        else:
+            delay = notify_retry_delay * 2 ** max(attempts - 1, 0)
+            cur.execute("UPDATE notif_jobs SET next_attempt_at = ? WHERE id = ?", (time.time() + delay, job_id))
+
+        con.commit()
+        return delay
+
+    return await run_db(finish)
+
+
+async def retry_notification_job(job_id: int) -> int:
+    """
+    Count a failed run of the job. Returns how many times it has failed. It is scheduled to run again after a delay
+    that doubles every time, until it is given up on after max_attempts.
+    """
+    def retry(con, cur):
+        cur.execute("UPDATE notif_jobs SET attempts = attempts + 1 WHERE id = ?", (job_id,))
+        cur.execute("SELECT attempts FROM notif_jobs WHERE id = ?", (job_id,))
+        attempts = cur.fetchone()[0]
+
+        if attempts >= notify_max_attempts:
+            cur.execute("UPDATE notif_jobs SET state = 'failed' WHERE id = ?", (job_id,))
+        else:
+            cur.execute(
+                "UPDATE notif_jobs SET next_attempt_at = ? WHERE id = ?",
+                (time.time() + notify_retry_delay * 2 ** (attempts - 1), job_id)
+            )
+        con.commit()
+        return attempts
+
+    return await run_db(retry)
 
 
 def multi_page_embed_generator(png_urls: tuple, embed: discord.Embed, link: str):
@@ -610,17 +2774,13 @@ class FeedbackButton(discord.ui.View):
             if interaction.user.id != self.user_id:
                 return await interaction.response.send_message("This button is not for you", ephemeral=True)
 
-        con, cur = get_db()
-
         self.search_query = self.search_query.replace('"', "")
-        cur.execute(
+
+        await db_execute(
             f"INSERT INTO search_feedback VALUES (?, ?, ?, ?)",
             (interaction.user.id, self.msg.id, self.search_query, True)
         )
 
-        con.commit()
-        con.close()
-
         await interaction.response.send_message("Thanks for your feedback!", ephemeral=True)
 
         # Disable all buttons
@@ -639,16 +2799,11 @@ class FeedbackButton(discord.ui.View):
 
         self.search_query = self.search_query.replace('"', "")
 
-        con, cur = get_db()
-
-        cur.execute(
+        await db_execute(
             f"INSERT INTO search_feedback VALUES (?, ?, ?, ?)",
             (interaction.user.id, self.msg.id, self.search_query, False)
         )
 
-        con.commit()
-        con.close()
-
         await interaction.response.send_message(
             "We're sorry to about hear that. Please let us know what went wrong! Feel free to DM <@837584356988944396>",
             ephemeral=True
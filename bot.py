@@ -1,7 +1,6 @@
 import os
 import sys
-import requests
-from backend import client, discord_token, console, init_database, base_api_url
+from backend import client, discord_token, console, init_database, probe_api_latency
 import discord
 
 init_database()
@@ -11,7 +10,10 @@ async def on_ready():
     print("Connected to Discord!")
     console.info(f"Bot is ready. Logged in as {client.user}")
     console.info(f"Latency with Discord: {round(client.latency * 1000, 2)}ms")
-    console.info(f"Latency with BPS API: {requests.get(base_api_url).elapsed.total_seconds() * 1000:.2f}ms")
+
+    api_latency = await probe_api_latency()
+    if api_latency is not None:
+        console.info(f"Latency with BPS API: {api_latency:.2f}ms")
 
 print("f")
 for file in os.listdir('./cogs'):
@@ -1,11 +1,11 @@
-import math
 import discord
 import time
 import discord.ext.pages
 from discord.ext import commands
-from backend import get_circular_list, console, embed_color, embed_footer, embed_title, categories, get_png, \
+from backend import console, embed_color, embed_footer, embed_title, categories, get_png, \
     search, owner_ids, DeleteButton, ConfirmButton, get_latest_circular, embed_url, FeedbackButton, \
-    ignored_circulars, create_search_dropdown, discord_invite_url, invite_url, get_db
+    create_search_dropdown, discord_invite_url, invite_url, db_fetchone, db_execute, circular_index, \
+    get_circular_list_pages
 from discord import SlashCommandGroup
 
 category_options = []
@@ -16,6 +16,15 @@ category_options_with_all = category_options.copy()
 category_options_with_all.insert(0, discord.OptionChoice("All", value="all"))
 
 
+async def search_autocomplete(ctx: discord.AutocompleteContext):
+    # Only uses the local index, since Discord gives autocomplete 3 seconds to answer
+    return [
+        # Choice names can be at most 100 characters long
+        discord.OptionChoice(f"{i['id']} | {i['title'].strip()}"[:100], value=str(i['id']))
+        for i in circular_index.complete(ctx.value or "")
+    ]
+
+
 class Commands(commands.Cog):
     def __init__(self, client):
         self.client = client
@@ -34,80 +43,21 @@ class Commands(commands.Cog):
         start = time.time()
         console.debug(category)
 
-        if category != "all":
-            raw_res = await get_circular_list(category)
-        else:
-            raw_res = []
-
-            for cat in categories:  # TODO make this faster
-                raw_res += await get_circular_list(cat)
-
-            # Sort it based on circular ID
-            raw_res.sort(key=lambda x: x['id'], reverse=True)
-
-        # Remove ignored_circulars from the list
-        raw_res = [i for i in raw_res if i['id'] not in ignored_circulars]
+        # The pages are only rebuilt when the cached list(s) were fetched again
+        page_list = await get_circular_list_pages(category)
 
         # If there are no circulars
-        if raw_res is None or raw_res == []:
-            console.error(f"Got an empty list of circulars from the API. raw_res was None or []")
+        if not page_list:
+            console.error(f"Got an empty list of circulars from the API. page_list was None or []")
             await ctx.respond("There was a bit of an issue on our end. Please try again later.")
-
-        page_list = []
-        titles = []
-        links = []
-
-        loop_int = 1  # The variable which will be used to add numbers into the embed
-
-        # Loop through the raw API output
-        for item in raw_res:
-            titles.append(f"**{loop_int}**. [{item['id']}]  `{item['title'].strip()}`")
-            links.append(f"{item['link']}")
-            loop_int += 1
-
-        embed = discord.Embed(color=embed_color)
-        if category != "all":
-            embed.title = f"Circular List | `{category.capitalize()}`"
-        else:
-            embed.title = "Circular List | All Categories"
-
-        embed.set_footer(text=embed_footer)
-        embed.set_author(name=embed_title)
-
-        count = 0
-
-        for title, link in zip(titles, links):
-            embed.add_field(name=title, value=link, inline=False)
-            count += 1
-
-            # If the embed has reached 10 pages
-            if count % 10 == 0:
-                console.debug(f"[Commands] | {count}")
-                embed.description = f"Format - `[ID] Circular Title`\nPage **{int(count / 10)}**\n"
-
-                # Save the current embed to a list
-                page_list.append(embed.copy())
-                embed.clear_fields()
-
-            # If this is the last, unfilled page
-            elif count == len(titles):
-                console.debug(f"[Commands] | {count}")
-                embed.description = f"Format - `[ID] Circular Title`\nPage **{int(math.ceil(count / 10))}**\n"
-
-                # Save the current embed to a list
-                page_list.append(embed.copy())
-                embed.clear_fields()
-
-        # Remove the last embed of the list if it is empty
-        if len(page_list[-1].fields) == 0:
-            page_list.pop()
+            return
 
         # Give 20 seconds timeout per page (minimum timeout is 60 seconds)
-        if (timeout := int(count / 10) * 20) < 60:
+        if (timeout := len(page_list) * 20) < 60:
             timeout = 60
 
         paginator = discord.ext.pages.Paginator(
-            pages=page_list, disable_on_timeout=True, timeout=timeout
+            pages=list(page_list), disable_on_timeout=True, timeout=timeout
         )
         await paginator.respond(ctx.interaction)
         console.debug(f"[Commands] | Search took {round(time.time() - start, 2)} seconds.")
@@ -135,7 +85,7 @@ class Commands(commands.Cog):
 
         # Get the circular image and add it to the embed
         try:
-            png_url = list(await get_png(link))
+            png_url = list(await get_png(link, id_))
         except ValueError:
             console.error(f"Could not get the PNG for circular {id_} from API. API returned non 200 HTTP code")
 
@@ -194,7 +144,7 @@ class Commands(commands.Cog):
         console.debug(f"[Commands] | Search took {round(time.time() - start, 2)} second(s).")
 
     @circular.command(name="search", description="Searches for a circular with a title or id.")
-    async def search(self, ctx, query: str):
+    async def search(self, ctx, query: discord.Option(str, autocomplete=search_autocomplete)):
         await ctx.defer()
         start = time.time()
 
@@ -207,7 +157,7 @@ class Commands(commands.Cog):
         embed.set_author(name=embed_title)
         embed.set_footer(text=embed_footer)
 
-        # Search for the circular through the API
+        # Search for the circular, locally once the circulars are indexed
         searched: tuple | None = await search(query, amount=5)
 
         # If no circular is found
@@ -266,7 +216,7 @@ class Commands(commands.Cog):
         embed.add_field(name="Circular ID", value=f"`{id_}`", inline=False)
         embed.add_field(name="Download URL", value=link, inline=False)
 
-        png_url = await get_png(link)  # Get the png file from the download url
+        png_url = await get_png(link, id_)  # Get the png file from the download url
         embed.set_image(url=png_url[0])  # Set the image to the embed
         embed.description = f"Search took {round(end - start, 2)} seconds. Requested by {author.mention}."
 
@@ -319,10 +269,7 @@ class Commands(commands.Cog):
                 )
                 return
 
-        con, cur = get_db()
-
-        cur.execute("SELECT * FROM guild_notify WHERE guild_id = ?", (guild.id,))
-        res = cur.fetchone()
+        res = await db_fetchone("SELECT * FROM guild_notify WHERE guild_id = ?", (guild.id,))
 
         # If a channel is already set up
         if res:
@@ -344,16 +291,14 @@ class Commands(commands.Cog):
 
         if message:
             message = message.replace("<", "").replace(">", "").replace('"', "")  # Remove the <> and " from the message
-            cur.execute(
+            await db_execute(
                 "INSERT INTO guild_notify (guild_id, channel_id, message) "
                 "VALUES (?, ?, ?)",
                 (guild.id, channel.id, message)
             )
 
         else:
-            cur.execute("INSERT INTO guild_notify (guild_id, channel_id) VALUES (?, ?)", (guild.id, channel.id))
-
-        con.commit()
+            await db_execute("INSERT INTO guild_notify (guild_id, channel_id) VALUES (?, ?)", (guild.id, channel.id))
 
         embed = discord.Embed(
             title="Circular Notification Setup",
@@ -382,8 +327,7 @@ class Commands(commands.Cog):
                                       f"\n\nPlease give me permission to do so or set another channel."
             await ctx.followup.send(embed=error_embed)
 
-            cur.execute(f"DELETE FROM guild_notify WHERE guild_id = ?", (guild.id,))
-            con.commit()
+            await db_execute(f"DELETE FROM guild_notify WHERE guild_id = ?", (guild.id,))
             return
 
     @admin.command(name="delete", description="Delete the server's circular notification configuration.")
@@ -409,11 +353,8 @@ class Commands(commands.Cog):
                     ).set_footer(text=embed_footer)
                 )
 
-        con, cur = get_db()
-
         # Check if the guild is in the database
-        cur.execute("SELECT * FROM guild_notify WHERE guild_id = ?", (guild.id,))
-        res = cur.fetchone()
+        res = await db_fetchone("SELECT * FROM guild_notify WHERE guild_id = ?", (guild.id,))
 
         if not res:
             embed = discord.Embed(
@@ -426,8 +367,7 @@ class Commands(commands.Cog):
             await ctx.followup.send(embed=embed)
             return
 
-        cur.execute("DELETE FROM guild_notify WHERE guild_id = ?", (ctx.guild.id,))
-        con.commit()  # Commit the changes to the database
+        await db_execute("DELETE FROM guild_notify WHERE guild_id = ?", (ctx.guild.id,))
 
         embed = discord.Embed(
             title="Success!",
@@ -497,10 +437,7 @@ class Commands(commands.Cog):
         embed.set_author(name=embed_title)
         embed.set_footer(text=embed_footer)
 
-        con, cur = get_db()
-
-        cur.execute("SELECT * FROM dm_notify WHERE user_id = ?", (ctx.author.id,))
-        res = cur.fetchone()
+        res = await db_fetchone("SELECT * FROM dm_notify WHERE user_id = ?", (ctx.author.id,))
 
         # If the user is already in the database => they are unsubscribing
         if res:
@@ -520,8 +457,7 @@ class Commands(commands.Cog):
                 return
 
             # Remove the user from the database
-            cur.execute("DELETE FROM dm_notify WHERE user_id = ?", (ctx.author.id,))
-            con.commit()
+            await db_execute("DELETE FROM dm_notify WHERE user_id = ?", (ctx.author.id,))
 
             embed.title = "Success!"
             embed.description = "You unsubscribed from notifications."
@@ -532,10 +468,9 @@ class Commands(commands.Cog):
         # Add them to the database
         if message:
             message = message.replace("<", "").replace(">", "").replace('"', "")
-            cur.execute("INSERT INTO dm_notify (user_id, message) VALUES (?, ?)", (ctx.author.id, message))
+            await db_execute("INSERT INTO dm_notify (user_id, message) VALUES (?, ?)", (ctx.author.id, message))
         else:
-            cur.execute("INSERT INTO dm_notify (user_id) VALUES (?)", (ctx.author.id,))
-        con.commit()
+            await db_execute("INSERT INTO dm_notify (user_id) VALUES (?)", (ctx.author.id,))
 
         embed.title = "Success!"  # Set the title to Success
         embed.description = "You successfully subscribed to DM notifications! " \
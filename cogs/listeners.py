@@ -6,17 +6,21 @@ import shutil
 import random
 import datetime
 import asyncio
-import pybpsapi
 from discord.ext import commands, tasks
 from backend import console, embed_color, embed_footer, embed_title, get_png, backup_interval, DeleteButton, \
-    status_interval, embed_url, base_api_url, send_to_guilds, send_to_users, statuses, \
-    circular_check_interval, get_db, mysql_config, storage_method, fallback_api_url, multi_page_embed_generator
+    status_interval, embed_url, send_to_guilds, send_to_users, statuses, \
+    circular_check_interval, run_db, storage_method, multi_page_embed_generator, \
+    api_cache, circular_index, CircularChecker, EmbedPayloads, rate_limiter, create_notification_job, get_next_notification_job, \
+    get_notification_job_delay, stream_notification_recipients, count_notification_recipients, finish_notification_round, \
+    retry_notification_job, notify_max_attempts, member_count_concurrency, get_bot_state, set_bot_state, timed_task, timed_operation
 
 
 class Listeners(commands.Cog):
     def __init__(self, client):
         self.client = client
         self.member_count = -1
+        self.job_worker: asyncio.Task | None = None
+        self.jobs_added = asyncio.Event()
 
         self.mention_embed = discord.Embed(
             title="Mention Message",
@@ -36,23 +40,34 @@ class Listeners(commands.Cog):
             inline=False
         )
 
-        if storage_method == 'sqlite':
-            self.circular_checker = pybpsapi.CircularChecker(
-                api_url=base_api_url, fallback_api_url=fallback_api_url, cache_method='sqlite',
-                db_path='./data/data.db', db_table="cache"
-            )
-        elif storage_method == 'mysql':
-            self.circular_checker = pybpsapi.CircularChecker(
-                api_url=base_api_url, fallback_api_url=fallback_api_url, cache_method='mysql',
-                db_table='cache', db_host=mysql_config['host'], db_user=mysql_config['user'],
-                db_password=mysql_config['password'], db_name=mysql_config['database'], db_port=mysql_config['port']
-            )
+        self.circular_checker = CircularChecker()
 
+        # on_ready doesn't fire again when the cog is reloaded, so the loops and the job worker are started here
+        if self.client.is_ready():
+            self._startup = asyncio.create_task(self.on_ready())
+
+    def cog_unload(self):
+        # Otherwise they keep running next to the reloaded cog's, and every notification is sent twice
+        for loop in (self.random_status, self.get_member_count, self.check_for_circular, self.backup):
+            loop.cancel()
+
+        if self.job_worker is not None:
+            self.job_worker.cancel()
 
     @commands.Cog.listener()
     async def on_ready(self):
         console.info(f"Cog : Listeners.py loaded.")
 
+        # Show the last known member count right away, get_member_count updates it in the background
+        if self.member_count == -1:
+            try:
+                self.member_count = await get_bot_state("member_count", -1)
+            except Exception as e:
+                console.warning(f"Could not load the last member count: {e}")
+
+            if self.member_count == -1:
+                self.member_count = sum(guild.member_count or 0 for guild in self.client.guilds)
+
         try:
             if not self.get_member_count.is_running():
                 self.get_member_count.start()
@@ -60,6 +75,9 @@ class Listeners(commands.Cog):
             if not self.check_for_circular.is_running():
                 self.check_for_circular.start()
 
+            # Resume the notification jobs that were interrupted by a restart
+            self.start_job_worker()
+
             if not self.random_status.is_running():
                 self.random_status.start()
 
@@ -67,9 +85,6 @@ class Listeners(commands.Cog):
                 if backup_interval >= 0.5:
                     self.backup.start()
 
-            while not self.member_count > -1:
-                await asyncio.sleep(1)
-
         except Exception as e:
             console.warning(e)
 
@@ -102,6 +117,7 @@ class Listeners(commands.Cog):
         console.info(f"Joined guild {guild.id}")
 
     @tasks.loop(seconds=status_interval * 60)
+    @timed_task
     async def random_status(self):
 
         # statuses format: ['type|activity', 'type|activity', 'type|activity']
@@ -133,58 +149,120 @@ class Listeners(commands.Cog):
         console.debug(f"Changed status to {activities[rand_int]}")
 
     @tasks.loop(seconds=3600 * 24)  # Run every 24 hours
+    @timed_task
     async def get_member_count(self):
-        _member_count = 0
+        semaphore = asyncio.Semaphore(member_count_concurrency)
 
-        for guild in self.client.guilds:
-            guild = await self.client.fetch_guild(guild.id, with_counts=True)
-            _member_count += guild.approximate_member_count
+        async def count(guild):
+            # The gateway already sent the member count of most guilds
+            if guild.member_count is not None:
+                return guild.member_count
 
-        self.member_count = _member_count
+            async with semaphore:
+                try:
+                    return (await self.client.fetch_guild(guild.id, with_counts=True)).approximate_member_count
+                except Exception as e:
+                    console.warning(f"[Listeners] | Could not get the member count of {guild.id}: {e}")
+                    return 0
+
+        self.member_count = sum(await asyncio.gather(*(count(guild) for guild in self.client.guilds)))
         console.debug(f"[Listeners] | Member Count: {self.member_count}")
 
+        try:
+            await set_bot_state("member_count", self.member_count)
+        except Exception as e:
+            console.warning(f"Could not save the member count: {e}")
+
     @tasks.loop(seconds=circular_check_interval * 60)
+    @timed_task
     async def check_for_circular(self):
-        # Check for new circulars
-        new_circular_objects = self.circular_checker.check()
+        # Check for new circulars. They are only marked as seen once their notification jobs are saved
+        new_circular_objects = await self.circular_checker.check(save=False)
         console.debug(f"New Circulars: {new_circular_objects}")
 
+        # The cached lists and latest circulars (and searches that didn't find the new ones) are now outdated
+        if new_circular_objects:
+            api_cache.invalidate("list/", "latest/", "search")
+
+        # So they can be searched for right away
+        for circular_object in new_circular_objects:
+            circular_index.add(circular_object, circular_object['category'])
+
         if len(new_circular_objects) > 19:
             console.warning(f"[Listeners] | More than 19 new circulars found. Skipping notification.")
+            await self.circular_checker.save()
             return
 
-        for circular_object in new_circular_objects:
-            # {'title': '...', 'link': '...', 'id': '...', 'category': '...'}
+        try:
+            for circular_object in new_circular_objects:
+                # {'title': '...', 'link': '...', 'id': '...', 'category': '...'}
+                job_id = await create_notification_job(circular_object)
+                console.info(f"[Listeners] | Created notification job {job_id} for circular {circular_object['id']}")
+        except Exception as err:
+            # Not saving the checker means these circulars are reported again on the next check
+            console.error(f"Error in creating notification jobs: {err}")
+            return
 
-            try:
-                await self.notify(circular_object['category'], circular_object)
-            except Exception as err:
-                console.error(err)
-                console.error(f"Error in notifying about circular {circular_object['id']}: {err}")
+        await self.circular_checker.save()
+
+        # Also picks up the jobs a restart interrupted, on the first check after startup
+        self.start_job_worker()
 
-            #console.debug(f"[Listeners] | No new circulars found.")
+    def start_job_worker(self):
+        # Wakes the worker up if it is waiting for a retry
+        self.jobs_added.set()
+
+        if self.job_worker is None or self.job_worker.done():
+            self.job_worker = asyncio.create_task(self.process_notification_jobs())
+
+    async def process_notification_jobs(self):
+        """Run notification jobs until none are left, including the ones created while this is running."""
+        try:
+            with timed_operation("task", "process_notification_jobs"):
+                await self._process_notification_jobs()
+        except Exception as err:
+            console.error(f"Error in processing notification jobs: {err}")
 
-    async def notify(self, _circular_category, _circular_obj):
-        # Gather all guilds
-        con, cur = get_db()
+    async def _process_notification_jobs(self):
+        while True:
+            self.jobs_added.clear()
 
-        cur.execute("SELECT * FROM guild_notify")
-        guild_notify = cur.fetchall()
+            # Jobs waiting for a retry are skipped, so one failing job doesn't hold up the newer ones
+            job = await get_next_notification_job()
+            if job is None:
+                delay = await get_notification_job_delay()
 
-        guilds = [x[0] for x in guild_notify]
-        channels = [x[1] for x in guild_notify]
-        messages = [x[2] for x in guild_notify]
+                # A job may have been added while the database was being asked
+                if delay is None and not self.jobs_added.is_set():
+                    return
+
+                try:
+                    await asyncio.wait_for(self.jobs_added.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, id_, category, title, link, attempts = job
+            circular_obj = {'id': id_, 'title': title, 'link': link}
+
+            try:
+                await self.notify(category, circular_obj, job_id)
+            except Exception as err:
+                console.error(f"Error in notifying about circular {id_} (job {job_id}): {err}")
 
-        # Gather all DMs
-        cur.execute("SELECT * FROM dm_notify")
-        users = cur.fetchall()
+                attempts = await retry_notification_job(job_id)
+                if attempts >= notify_max_attempts:
+                    console.error(f"[Listeners] | Giving up on notification job {job_id} after {attempts} attempts.")
+                continue
 
-        user_ids = [x[0] for x in users]
-        user_messages = [x[1] for x in users]
-        del users, guild_notify
+            # Recipients that failed are retried later, with a growing delay, until they run out of attempts
+            delay = await finish_notification_round(job_id)
+            if delay is not None:
+                console.info(f"[Listeners] | Retrying the failed recipients of circular {id_} in {delay}s.")
 
-        # Create an empty dict for logging
-        notif_msgs = {"guild": [], "dm": []}
+    async def notify(self, _circular_category, _circular_obj, job_id: int):
+        # The number of messages sent, for logging
+        sent_counts = {"guild": 0, "dm": 0}
 
         # Get the circular info and prepare the embed
         link: str = _circular_obj['link']
@@ -192,11 +270,10 @@ class Listeners(commands.Cog):
         id_ = _circular_obj['id']
 
         # Get the circular image
-        png_urls = await get_png(link)
+        png_urls = await get_png(link, id_)
 
         if not png_urls:
-            console.warning(f"Error in getting circular image for {id_}. It is None.")
-            return
+            raise ValueError(f"Error in getting circular image for {id_}. It is None.")
 
         # Create the error embed
         error_embed = discord.Embed(title=f"Error!", color=embed_color)
@@ -214,17 +291,34 @@ class Listeners(commands.Cog):
         embed.add_field(name=f"[{id_}]  `{title.strip()}`", value=link, inline=False)
 
         embed_list = multi_page_embed_generator(png_urls=png_urls, embed=embed, link=link)
-
-        # Gather all guilds/users and send the embed
-        await send_to_guilds(guilds, channels, messages, notif_msgs, embed_list, error_embed, id_)
-        await send_to_users(user_ids, user_messages, notif_msgs, embed_list, id_)
+        # Converted once here, instead of for every recipient
+        embeds = EmbedPayloads(embed_list)
+
+        # Send to the recipients that are still pending, and the failed ones with attempts left
+        guild_count, user_count = await count_notification_recipients(job_id)
+
+        if guild_count or user_count:
+            # Recipients are streamed from the database in chunks, straight into the senders.
+            # If one of them fails, the other one still finishes before the round is retried, so that nothing it
+            # delivers in the meantime goes unrecorded and gets sent again
+            results = await asyncio.gather(
+                send_to_guilds(stream_notification_recipients(job_id, "guild"), sent_counts, embeds, error_embed,
+                               id_, job_id),
+                send_to_users(stream_notification_recipients(job_id, "dm"), sent_counts, embeds, id_, job_id),
+                return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
 
         console.info(
-            f"Notified {len(notif_msgs['guild'])} guilds and {len(notif_msgs['dm'])} "
+            f"Notified {sent_counts['guild']} guilds and {sent_counts['dm']} "
             f"users about the new circular. ({id_})"
         )
+        console.info(f"[Listeners] | Discord rate limits: {rate_limiter.stats()}")
 
     @tasks.loop(minutes=backup_interval * 60)
+    @timed_task
     async def backup(self):
         now = datetime.datetime.now()
         date_time = now.strftime("%d-%m-%Y-%H-%M")
@@ -241,34 +335,36 @@ class Listeners(commands.Cog):
             with open(f'./data/backups/data-{date_time}.db') as f:
                 f.write(b'')
 
-            backup_con = sqlite3.connect(f'./data/backups/data-{date_time}.db')
-            backup_cur = backup_con.cursor()
-
-            con, cur = get_db()
-
-            # Copy guild_notify
-            cur.execute('SELECT * FROM guild_notify;')
-            data = cur.fetchall()
-            backup_cur.executemany(
-                'INSERT INTO guild_notify (guild_id, channel_id, message) VALUES (?, ?, ?)',
-                data
-            )
-
-            # Copy dm_notify
-            cur.execute('SELECT * FROM dm_notify;')
-            data = cur.fetchall()
-            backup_cur.executemany(
-                'INSERT INTO dm_notify (user_id, message) VALUES (?, ?)',
-                data
-            )
-
-            # Copy notif_msgs
-            cur.execute('SELECT * FROM notif_msgs;')
-            data = cur.fetchall()
-            backup_cur.executemany(
-                'INSERT INTO notif_msgs (circular_id, type, msg_id, channel_id, guild_id) VALUES (?, ?, ?, ?, ?)',
-                data
-            )
+            def copy_tables(con, cur):
+                # sqlite connections can only be used by the thread that made them
+                backup_con = sqlite3.connect(f'./data/backups/data-{date_time}.db')
+                backup_cur = backup_con.cursor()
+
+                # Copy guild_notify
+                cur.execute('SELECT * FROM guild_notify;')
+                data = cur.fetchall()
+                backup_cur.executemany(
+                    'INSERT INTO guild_notify (guild_id, channel_id, message) VALUES (?, ?, ?)',
+                    data
+                )
+
+                # Copy dm_notify
+                cur.execute('SELECT * FROM dm_notify;')
+                data = cur.fetchall()
+                backup_cur.executemany(
+                    'INSERT INTO dm_notify (user_id, message) VALUES (?, ?)',
+                    data
+                )
+
+                # Copy notif_msgs
+                cur.execute('SELECT * FROM notif_msgs;')
+                data = cur.fetchall()
+                backup_cur.executemany(
+                    'INSERT INTO notif_msgs (circular_id, type, msg_id, channel_id, guild_id) VALUES (?, ?, ?, ?, ?)',
+                    data
+                )
+
+            await run_db(copy_tables)
 
         console.info(f"Backed up the database to ./data/backups/data-{date_time}.db")
 
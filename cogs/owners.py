@@ -1,8 +1,13 @@
+import asyncio
 import discord
+import io
 import math
+import time
 from discord.ext import commands
 from backend import owner_ids, embed_title, embed_footer, embed_color, console, owner_guilds, get_png, ConfirmButton, \
-    DeleteButton, search, embed_url, send_to_guilds, send_to_users, categories, get_db, multi_page_embed_generator
+    DeleteButton, search, embed_url, send_to_guilds, send_to_users, categories, db_connection, multi_page_embed_generator, \
+    invalidate_png_cache, run_db, db_fetchone, db_fetchall, db_executemany, stream_subscribers, \
+    EmbedPayloads, rate_limiter, RateLimiter, fan_out, metrics, record_time, api_single_flight
 
 category_options = []
 for i in categories:
@@ -56,18 +61,20 @@ class Owners(commands.Cog):
             return await ctx.respond("You are not allowed to use this command.")
         await ctx.defer()
 
-        con, cur = get_db()
+        def execute(con, cur):
+            cur.execute(query)
+            _res = cur.fetchall()
+            con.commit()
+            return _res
 
         try:
-            cur.execute(query)
+            res = await run_db(execute)
         except Exception as e:
             await ctx.followup.send(embed=discord.Embed(title="Execute SQL", description=f"**Error!**\n{e}",
                                                         color=discord.colour.Color.red()).set_footer(
                 text=embed_footer).set_author(name=embed_title), ephemeral=True)
             return
 
-        res = cur.fetchall()
-
         if len(res) == 0:
             embed = discord.Embed(title="Execute SQL", description="**Success!**\nNo results found.",
                                   color=embed_color).set_footer(text=embed_footer).set_author(name=embed_title)
@@ -78,8 +85,6 @@ class Owners(commands.Cog):
             for i in res:
                 embed.add_field(name=str(i), value=str(i), inline=False)
 
-        con.commit()
-
         msg = await ctx.followup.send(embed=embed)
         await msg.edit(embed=embed, view=DeleteButton(ctx, msg))
 
@@ -138,7 +143,6 @@ class Owners(commands.Cog):
             return await ctx.respond("You are not allowed to use this command.")
 
         await ctx.defer()
-        con, cur = get_db()
 
         embed = discord.Embed(title=f"New Circular | **{category.capitalize()}** ", color=embed_color, url=embed_url)
         embed.set_footer(text=embed_footer)
@@ -149,15 +153,19 @@ class Owners(commands.Cog):
         if custom_message is not None:  # If the user has provided a custom message
             embed.add_field(name="Message from the Developer", value=custom_message, inline=False)
 
-        png_urls = await get_png(url)  # Get the png from the url
+        png_urls = await get_png(url, id_)  # Get the png from the url
         embed.set_image(url=png_urls[0])  # Set the image of the embed to the file
 
-        notif_msgs = {"guild": [], "dm": []}
+        sent_counts = {"guild": 0, "dm": 0}
         embed_list = multi_page_embed_generator(png_urls=png_urls, embed=embed, link=url)
 
         if debug_guild:  # If a debug guild is specified, send the message to ONLY that guild.
-            cur.execute("SELECT message FROM guild_notify WHERE guild_id = ?", (debug_guild,))
-            message = cur.fetchone()  # Get the reminder-message for the guild from the DB
+            # Get the reminder-message for the guild from the DB
+            message = await db_fetchone("SELECT message FROM guild_notify WHERE guild_id = ?", (debug_guild,))
+
+            # Get the channel_id for the guild from the DB
+            channel_id = (await db_fetchone("SELECT channel_id FROM guild_notify WHERE guild_id = ?", (int(debug_guild),)))[0]
+
             console.debug(f"[Owners] | Message: {message}")
 
             if not message:  # If the message is not found
@@ -166,17 +174,14 @@ class Owners(commands.Cog):
             embed.description = message[0]  # Set the description of the embed to the message
 
             guild = await self.client.fetch_guild(int(debug_guild))  # Get the guild object
-            cur.execute("SELECT channel_id FROM guild_notify WHERE guild_id = ?", (guild.id,))
-            channel_id = cur.fetchone()[0]  # Get the channel_id for the guild from the DB
-
             channel = await guild.fetch_channel(int(channel_id))  # Get the channel object
 
             await channel.send(embeds=embed_list)  # Send the embed
             return await ctx.respond(f"Notified the `{debug_guild}` server.")  # Respond to the user and return
 
         elif debug_user:  # If a debug user is specified, send the message to ONLY that user.
-            cur.execute("SELECT message FROM dm_notify WHERE user_id = ?", (debug_user,))
-            message = cur.fetchone()  # Get the reminder-message for the user from the DB
+            # Get the reminder-message for the user from the DB
+            message = await db_fetchone("SELECT message FROM dm_notify WHERE user_id = ?", (debug_user,))
             console.debug(f"[Owners] | Message: {message}")
 
             if not message:
@@ -202,20 +207,6 @@ class Owners(commands.Cog):
                 await ctx.respond("Cancelled.")
                 return
 
-            cur.execute("SELECT * FROM guild_notify")  # Get all the guilds from the database
-            guild_notify = cur.fetchall()
-
-            guilds = [x[0] for x in guild_notify]  # Get all the guild_id s from the database
-            channels = [x[1] for x in guild_notify]  # Get all the channel_id s from the database
-            messages = [x[2] for x in guild_notify]  # Get all the messages from the database
-
-            cur.execute("SELECT * FROM dm_notify")  # Get all the users from the database
-            users = cur.fetchall()  # Get all the user_id s from the database
-
-            user_ids = [x[0] for x in users]
-            user_messages = [x[1] for x in users]
-            del users, guild_notify
-
             error_embed = discord.Embed(title=f"Error!",
                                         description="Please make sure that I have the permission "
                                                     "to send messages in the channel you set for notifications.",
@@ -223,30 +214,33 @@ class Owners(commands.Cog):
             error_embed.set_footer(text=embed_footer)
             error_embed.set_author(name=embed_title)
 
+            # The guilds and users are streamed from the database in chunks, and share the converted embeds
+            embeds = EmbedPayloads(embed_list)
+
             match send_only_to:  # If it has been specified to send the notifications to only servers/dms
                 case "dms":  # Send notifications to dms
                     await send_to_users(
-                        user_ids=user_ids, user_messages=user_messages, notif_msgs=notif_msgs,
-                        embed_list=embed_list, id_=id_
+                        users=stream_subscribers("dm"), sent_counts=sent_counts, embeds=embeds, id_=id_
                     )
 
                 case "servers":  # Send notifications to servers
                     await send_to_guilds(
-                        guilds=guilds, channels=channels, messages=messages, notif_msgs=notif_msgs,
-                        embed_list=embed_list, error_embed=error_embed, id_=id_
+                        guilds=stream_subscribers("guild"), sent_counts=sent_counts, embeds=embeds,
+                        error_embed=error_embed, id_=id_
                     )
 
                 case _:
-                    await send_to_guilds(
-                        guilds=guilds, channels=channels, messages=messages, notif_msgs=notif_msgs,
-                        embed_list=embed_list, error_embed=error_embed, id_=id_
-                    )
-                    await send_to_users(
-                        user_ids=user_ids, user_messages=user_messages, notif_msgs=notif_msgs,
-                        embed_list=embed_list, id_=id_
+                    await asyncio.gather(
+                        send_to_guilds(
+                            guilds=stream_subscribers("guild"), sent_counts=sent_counts, embeds=embeds,
+                            error_embed=error_embed, id_=id_
+                        ),
+                        send_to_users(
+                            users=stream_subscribers("dm"), sent_counts=sent_counts, embeds=embeds, id_=id_
+                        )
                     )
 
-            console.info(f"Sent Circular to {len(notif_msgs['dm'])} users and {len(notif_msgs['guild'])} guilds.")
+            console.info(f"Sent Circular to {sent_counts['dm']} users and {sent_counts['guild']} guilds.")
 
     @owners.command(name="logs", description="Get bot logs.")
     async def get_logs(self, ctx,
@@ -271,7 +265,6 @@ class Owners(commands.Cog):
         if ctx.author.id not in owner_ids:
             return await ctx.respond("You are not allowed to use this command.")
         await ctx.defer()
-        con, cur = get_db()
 
         if level == "all":
             level = None
@@ -279,20 +272,21 @@ class Owners(commands.Cog):
         if category == "all":
             category = None
 
-        # get logs from sql
+        # get logs from sql, newest first. Levels are saved as logging's level names, which are upper case
+        columns = "SELECT timestamp, level, category, message FROM logs"
         if level is None and category is None:
-            cur.execute("SELECT * FROM logs ORDER BY timestamp DESC LIMIT ?", (amount,))
+            logs = await db_fetchall(f"{columns} ORDER BY timestamp DESC LIMIT ?", (amount,))
         elif level is None:
-            cur.execute("SELECT * FROM logs WHERE category = ? ORDER BY timestamp DESC LIMIT ?",
-                             (category, amount))
+            logs = await db_fetchall(f"{columns} WHERE category = ? ORDER BY timestamp DESC LIMIT ?",
+                                     (category, amount))
         elif category is None:
-            cur.execute("SELECT * FROM logs WHERE log_level = ? ORDER BY timestamp DESC LIMIT ?",
-                             (level, amount))
+            logs = await db_fetchall(f"{columns} WHERE level = ? ORDER BY timestamp DESC LIMIT ?",
+                                     (level.upper(), amount))
         else:
-            cur.execute("SELECT * FROM logs WHERE log_level = ? AND category = ? ORDER BY timestamp DESC LIMIT ?",
-                             (level, category, amount))
-
-        logs = cur.fetchall()
+            logs = await db_fetchall(
+                f"{columns} WHERE level = ? AND category = ? ORDER BY timestamp DESC LIMIT ?",
+                (level.upper(), category, amount)
+            )
 
         if not logs:
             return await ctx.respond("No logs found.", ephemeral=True)
@@ -303,9 +297,9 @@ class Owners(commands.Cog):
 
         pages = []
         i = 1
-        # Log format: (timestamp, log_level, category, message)
+        # Log format: (timestamp, level, category, message)
         for _log in logs:
-            embed.add_field(name=f"**{i}** <t:{_log[0]}:f>", value=f"```{_log[3]}```", inline=False)
+            embed.add_field(name=f"**{i}** {_log[0]} | {_log[1]}", value=f"```{_log[3]}```", inline=False)
             i += 1
 
             if i % 10 == 0:
@@ -321,6 +315,105 @@ class Owners(commands.Cog):
         )
         await paginator.respond(ctx.interaction, ephemeral=True)
 
+    async def get_notif_messages(self, id_: int, type_: str = None, limit: int = None) -> list[tuple]:
+        """
+        Returns (msg_id, channel_id, type, message) for the notification messages of a circular, newest first.
+        message is the custom message the recipient had when it was sent, or has now if it wasn't sent by a job.
+        """
+        query = """
+            SELECT m.msg_id, m.channel_id, m.type,
+                CASE WHEN r.job_id IS NOT NULL THEN r.message ELSE COALESCE(g.message, d.message) END
+            FROM notif_msgs m
+            LEFT JOIN notif_jobs j ON j.circular_id = m.circular_id
+            LEFT JOIN notif_recipients r ON r.job_id = j.id AND r.type = m.type AND r.recipient_id = m.channel_id
+            LEFT JOIN guild_notify g ON m.type = 'guild' AND g.channel_id = m.channel_id
+            LEFT JOIN dm_notify d ON m.type = 'dm' AND d.user_id = m.channel_id
+            WHERE m.circular_id = ?
+        """
+        params = [id_]
+
+        if type_ is not None:
+            query += " AND m.type = ?"
+            params.append(type_)
+
+        # Message ids are snowflakes, so they sort by the time they were sent
+        query += " ORDER BY m.msg_id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return await db_fetchall(query, tuple(params))
+
+    async def get_partial_notif_message(self, msg_id: int, channel_id: int, type_: str) -> discord.PartialMessage:
+        """Get a notification message without fetching it. For DMs, channel_id is the user's id."""
+        if type_ == "dm":
+            user = self.client.get_user(channel_id) or await self.client.fetch_user(channel_id)
+            channel = user.dm_channel or await user.create_dm()
+        else:
+            channel = self.client.get_channel(channel_id) or self.client.get_partial_messageable(channel_id)
+
+        return channel.get_partial_message(msg_id)
+
+    async def bulk_notif_action(self, ctx, id_: int, rows: list[tuple], action, verb: str) -> dict:
+        """
+        Run action(partial_message, message) for notification messages (rows of get_notif_messages) concurrently,
+        showing the progress in the command's response. Messages that don't exist anymore are removed from the
+        database. Every action waits for its turn with the rate limiter.
+        """
+        gone = []
+
+        async def worker(row):
+            msg_id, channel_id, type_, message = row
+            priority = RateLimiter.DM if type_ == "dm" else RateLimiter.GUILD
+
+            try:
+                start = time.perf_counter()
+                partial = await self.get_partial_notif_message(msg_id, channel_id, type_)
+                record_time("discord", time.perf_counter() - start)
+
+                await rate_limiter.wait(priority)
+                start = time.perf_counter()
+                try:
+                    await action(partial, message)
+                finally:
+                    record_time("discord", time.perf_counter() - start)
+
+            # The message, the channel or the bot's access to it is gone
+            except (discord.NotFound, discord.Forbidden):
+                gone.append((id_, msg_id))
+                raise
+
+        async def progress(stats):
+            await ctx.edit(content=f"{verb}... {stats['done'] + stats['failed'] + stats['skipped']}/{len(rows)}")
+
+        await ctx.respond(f"{verb} {len(rows)} messages...")
+        stats = await fan_out(rows, worker, f"Owners {verb}", progress=progress)
+
+        if gone:
+            console.warning(f"[Owners] | {len(gone)} notification messages of circular {id_} don't exist anymore.")
+            await db_executemany("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", gone)
+
+        return stats
+
+    async def delete_notif_messages(self, ctx, id_: int, rows: list[tuple]) -> dict:
+        deleted = []
+
+        async def delete(partial, message):
+            try:
+                await partial.delete()
+            except discord.NotFound:
+                pass  # Already deleted, which is all that was asked for
+
+            deleted.append((id_, partial.id))
+
+        stats = await self.bulk_notif_action(ctx, id_, rows, delete, "Deleting")
+
+        # Only the deleted messages are removed from the database. The ones that failed (eg. a 5xx or a timeout) are
+        # kept, so that they can still be edited or deleted later
+        if deleted:
+            await db_executemany("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", deleted)
+        return stats
+
     @owners.command(name="editnotif", description="Edit a notification message.")
     async def edit_notif(self, ctx, id_: int,
                          update_type: discord.Option(choices=[
@@ -335,95 +428,61 @@ class Owners(commands.Cog):
             return await ctx.respond("You are not allowed to use this command.")
         await ctx.defer()
 
-        msg_list = []
-        con, cur = get_db()
-
-        # Get the message ids of the circular embeds
-        cur.execute("SELECT msg_id, channel_id FROM notif_msgs WHERE circular_id = ? AND type = 'dm'", (id_,))
-        dm_msgs = cur.fetchall()
-        cur.execute("SELECT msg_id, channel_id, guild_id FROM notif_msgs WHERE circular_id = ? AND type = 'guild'",
-                         (id_,))
-        guild_msgs = cur.fetchall()
-
-        for msg in dm_msgs:
-            try:
-                user = await self.client.fetch_user(msg[1])
-                message = await user.fetch_message(msg[0])
-                msg_list.append(message)
-
-            except discord.NotFound:
-                console.warning(f"Could not find DM message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                con.commit()
-                continue
-
-            except discord.Forbidden:
-                console.warning(f"Could not fetch DM message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                con.commit()
-                continue
-
-            except Exception as e:
-                console.error(f"Could not fetch DM message with id {msg[0]}")
-                console.error(e)
-                continue
-
-        for msg in guild_msgs:
-            try:
-                guild = await self.client.fetch_guild(msg[2])
-                channel = await guild.fetch_channel(msg[1])
-                message = discord.utils.get(await channel.history(limit=100).flatten(), id=msg[0])
-                msg_list.append(message)
-
-            except discord.NotFound:
-                console.warning(f"Could not find guild message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                continue
+        rows = await self.get_notif_messages(id_)
+        if not rows:
+            return await ctx.respond("No notification messages found for this circular.")
 
         match update_type:
             case "image":
-                await ctx.respond("Updating images...")
-                counter = 0
-
                 circular_obj = (await search(id_))[0]
-                png = await get_png(circular_obj['link'])
+                png = await get_png(circular_obj['link'], id_)
 
-                embed_list = multi_page_embed_generator(png_urls=png, embed=msg_list[0].embeds[0], link=circular_obj['link'])
+                # Only the newest message is fetched, to reuse its embed
+                template = None
+                for msg_id, channel_id, type_, _ in rows:
+                    try:
+                        template = await (await self.get_partial_notif_message(msg_id, channel_id, type_)).fetch()
+                        break
+                    except discord.HTTPException:
+                        continue
 
-                # For each notification message that was sent
-                for msg in msg_list:
+                if template is None:
+                    return await ctx.respond("Could not fetch any of the notification messages.")
 
-                    # Modify all embeds to have the correct description
-                    # TODO it might be possible to set each embed's description to a variable and modify that variable only
-                    for embed in embed_list:
-                        embed.description = msg.embeds[0].description
+                embed_list = multi_page_embed_generator(
+                    png_urls=png, embed=template.embeds[0], link=circular_obj['link']
+                )
+                embed_lists = {}
 
-                    await msg.edit(embeds=embed_list)
+                async def reload_image(partial, message):
+                    # Set the correct description, once for every distinct message
+                    if message not in embed_lists:
+                        embeds = [embed.copy() for embed in embed_list]
+                        embeds[0].description = message
+                        embed_lists[message] = embeds
 
-                    counter += 1
-                    if counter % 10 == 0:
-                        await ctx.response.edit_original_message(f"Updating images... {counter}/{len(msg_list)}")
+                    await partial.edit(embeds=embed_lists[message])
 
-                await ctx.response.edit_original_message(f"Successfully updated {len(msg_list)} messages.")
-                return
+                stats = await self.bulk_notif_action(ctx, id_, rows, reload_image, "Updating images")
 
             case "delete":
-                for msg in msg_list:
-                    await msg.delete()
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ?", (id_,))
-                con.commit()
+                stats = await self.delete_notif_messages(ctx, id_, rows)
 
             case "dev_message":
-                for msg in msg_list:
-                    current_embed = msg.embeds[0]
-                    current_embed.add_field(name="Dev Message", value=dev_message)
-                    await msg.edit(embed=current_embed)
+                async def add_dev_message(partial, message):
+                    # The current embeds are needed to add to them
+                    await rate_limiter.wait()
+                    msg = await partial.fetch()
 
-        await ctx.respond(f"Successfully updated {len(msg_list)} messages.")
+                    embeds = msg.embeds
+                    embeds[0].add_field(name="Dev Message", value=dev_message)
+                    await partial.edit(embeds=embeds)
 
+                stats = await self.bulk_notif_action(ctx, id_, rows, add_dev_message, "Adding the dev message")
 
+        await ctx.edit(content=f"Successfully updated {stats['done']} messages ({stats['failed']} failed).")
 
-    #@owners.command(name="deletenotif", description="Edit a notification message.")
+    @owners.command(name="deletenotif", description="Delete the notification messages of a circular.")
     async def delete_notif(self, ctx, id_: int,
                          delete_from: discord.Option(choices=[
                              discord.OptionChoice("Server", value="server"),
@@ -437,72 +496,70 @@ class Owners(commands.Cog):
             return await ctx.respond("You are not allowed to use this command.")
         await ctx.defer()
 
-        msg_list = []
-        con, cur = get_db()
+        type_ = {"server": "guild", "dm": "dm"}.get(delete_from)
+        rows = await self.get_notif_messages(id_, type_, most_recent_x)
+        if not rows:
+            return await ctx.respond("No notification messages found for this circular.")
 
-        # Get the message ids of the circular embeds
-        cur.execute("SELECT msg_id, channel_id FROM notif_msgs WHERE circular_id = ? AND type = 'dm'", (id_,))
-        dm_msgs = cur.fetchall()
-        cur.execute("SELECT msg_id, channel_id, guild_id FROM notif_msgs WHERE circular_id = ? AND type = 'guild'",
-                         (id_,))
-        guild_msgs = cur.fetchall()
+        stats = await self.delete_notif_messages(ctx, id_, rows)
+        await ctx.edit(content=f"Successfully deleted {stats['done']} messages ({stats['failed']} failed).")
 
-        for msg in dm_msgs:
-            if delete_from == "server":
-                break
-            try:
-                user = await self.client.fetch_user(msg[1])
-                message = await user.fetch_message(msg[0])
-                msg_list.append(message)
+    @owners.command(name="clearpng", description="Clear the cached page images of a circular, or of all circulars.")
+    async def clear_png_cache(self, ctx, id_: int = None, url: str = None):
+        if ctx.author.id not in owner_ids:
+            return await ctx.respond("You are not allowed to use this command.")
+        await ctx.defer()
 
-            except discord.NotFound:
-                console.warning(f"Could not find DM message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                con.commit()
-                continue
+        # If neither the ID nor the URL is given, the whole cache is cleared
+        removed = await invalidate_png_cache(circular_id=id_, download_url=url)
 
-            except discord.Forbidden:
-                console.warning(f"Could not fetch DM message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                con.commit()
-                continue
+        console.info(f"[Owners] | Removed {removed} circulars from the PNG cache. ID: {id_}, URL: {url}")
+        await ctx.respond(f"Removed {removed} circular(s) from the PNG cache.")
 
-            except Exception as e:
-                console.error(f"Could not fetch DM message with id {msg[0]}")
-                console.error(e)
-                continue
+    @owners.command(name="metrics", description="See where the bot spends its time.")
+    async def metrics_(self, ctx):
+        if ctx.author.id not in owner_ids:
+            return await ctx.respond("You are not allowed to use this command.")
 
-        for msg in guild_msgs:
-            if delete_from == "dm":
-                break
-            try:
-                guild = await self.client.fetch_guild(msg[2])
-                channel = await guild.fetch_channel(msg[1])
-                message = discord.utils.get(await channel.history(limit=100).flatten(), id=msg[0])
-                msg_list.append(message)
+        embed = discord.Embed(title="Metrics", color=embed_color)
+        embed.set_footer(text=embed_footer)
+        embed.set_author(name=embed_title)
 
-            except discord.NotFound:
-                console.warning(f"Could not find guild message with id {msg[0]}")
-                cur.execute("DELETE FROM notif_msgs WHERE circular_id = ? AND msg_id = ?", (id_, msg[0]))
-                con.commit()
+        # One line per command/task: runs, average and p95 time, and the average time spent waiting on each part
+        lines = []
+        for labels, total in sorted(metrics.histograms.get("bot_operation_seconds", {}).items()):
+            labels = dict(labels)
+            if labels['part'] != "total":
                 continue
 
-        msg_list.reverse()
-
-        counter = 0
-        for msg in msg_list:
-            if most_recent_x is not None:
-                if counter >= most_recent_x:
-                    break
-            counter += 1
-
-
-            await msg.delete()
-            cur.execute("DELETE FROM notif_msgs WHERE circular_id = ?", (id_,))
-            con.commit()
+            parts = []
+            for part in ("api", "db", "discord"):
+                histogram = metrics.histogram("bot_operation_seconds", **{**labels, 'part': part})
+                parts.append(f"{part} {histogram.sum / histogram.count:.2f}s")
+
+            lines.append(
+                f"`{labels['name']}` ({labels['kind']}) - {total.count} runs, avg {total.sum / total.count:.2f}s, "
+                f"p95 {total.quantile(0.95):.2f}s | {', '.join(parts)}"
+            )
+        embed.description = "\n".join(lines)[:4000] or "Nothing has been timed yet."
+
+        flights = api_single_flight.stats()
+        embed.add_field(
+            name="API calls",
+            value=f"{flights['calls']} calls, {flights['coalesced']} coalesced, {flights['in_flight']} in flight",
+            inline=False
+        )
 
+        for name, series in sorted(metrics.counters.items()):
+            value = "\n".join(
+                f"{', '.join(f'{k}={v}' for k, v in labels) or 'total'}: {int(count)}"
+                for labels, count in sorted(series.items())
+            )
+            embed.add_field(name=name, value=value[:1024], inline=False)
 
-        await ctx.respond(f"Successfully deleted {counter} messages.")
+        # Everything, in the same format as the metrics endpoint
+        file = discord.File(io.BytesIO(metrics.render().encode()), filename="metrics.txt")
+        await ctx.respond(embed=embed, file=file, ephemeral=True)
 
     @owners.command()
     async def send_msg(self, ctx, user_id: str, msg: str):
@@ -525,20 +582,38 @@ class Owners(commands.Cog):
             return await ctx.respond("You are not allowed to use this command.")
         await ctx.defer()
 
-        if conversion == "mysql":
-            # Convert from SQLITE3 to MYSQL
-            sqlite_con, sqlite_cur = get_db('sqlite3')
-            mysql_con, mysql_cur = get_db('mysql')
+        source = "sqlite" if conversion == "mysql" else "mysql"
+
+        # Runs on a database thread with a connection to the source, like every other database access
+        def copy_tables(source_con, source_cur) -> dict:
+            copied = {}
+
+            if source == "sqlite":
+                source_cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
+            else:
+                source_cur.execute("SHOW TABLES;")
+            tables = [table[0] for table in source_cur.fetchall()]
+
+            with db_connection(conversion) as (target_con, target_cur):
+                # Copy all tables from the source DB to the target
+                for table in tables:
+                    source_cur.execute(f"SELECT * FROM `{table}`;")
+                    columns = [column[0] for column in source_cur.description]
+                    data = source_cur.fetchall()
+
+                    if data:
+                        target_cur.executemany(
+                            f"INSERT INTO `{table}` ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                            data
+                        )
+                    copied[table] = len(data)
 
-            # Copy all tables from SQLITE DB to MYSQL
-            sqlite_cur.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = [table[0] for table in sqlite_cur.fetchall()]
+                target_con.commit()
 
-            for table in tables:
-                sqlite_cur.execute(f"SELECT * FROM {table};")
-                data = sqlite_cur.fetchall()
+            return copied
 
-                mysql_cur.execute(f"INSERT INTO {table} ")
+        copied = await run_db(copy_tables, storage_method_override=source)
+        await ctx.respond(f"Copied {sum(copied.values())} rows from {len(copied)} tables from {source} to {conversion}.")
 
 
 def setup(client):
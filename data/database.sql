@@ -1,43 +1,98 @@
--- This code creates the database and tables for /data/data.db
--- There are 6 tables
+-- The schema of ./data/data.db after all migrations, for reference.
+-- init_database() in backend.py creates and migrates the database, so this file doesn't need to be run.
+-- When changing the schema, add a migration to MIGRATIONS in backend.py and update this file to match.
+
+CREATE TABLE IF NOT EXISTS "schema_version" (
+	"version"	INT NOT NULL
+);
 
 CREATE TABLE IF NOT EXISTS "dm_notify" (
-	"user_id"	INT NOT NULL,
+	"user_id"	BIGINT UNSIGNED NOT NULL UNIQUE,
 	"message"	TEXT DEFAULT 'A new Circular was just posted on the website!'
 );
 
 CREATE TABLE IF NOT EXISTS "guild_notify" (
-	"guild_id"	INTEGER NOT NULL UNIQUE,
-	"channel_id"	INTEGER NOT NULL UNIQUE,
-	"message"	TEXT DEFAULT "There's a new circular up on the website!"
+	"guild_id"	BIGINT UNSIGNED NOT NULL UNIQUE,
+	"channel_id"	BIGINT UNSIGNED UNIQUE,
+	"message"	TEXT DEFAULT 'There''s a new circular up on the website!'
 );
 
-CREATE TABLE IF NOT EXISTS "logs" (
-	"timestamp"	INTEGER NOT NULL,
-	"log_level"	TEXT NOT NULL DEFAULT 'debug',
-	"category"	TEXT NOT NULL,
-	"msg"	TEXT
+CREATE TABLE IF NOT EXISTS "notif_msgs" (
+	"circular_id"	INT NOT NULL,
+	"type"	TEXT NOT NULL,  -- VARCHAR(16) on mysql
+	"msg_id"	BIGINT UNSIGNED NOT NULL UNIQUE,
+	"channel_id"	BIGINT UNSIGNED,
+	"guild_id"	BIGINT UNSIGNED
+);
+
+CREATE INDEX "idx_notif_msgs_circular_type" ON "notif_msgs" ("circular_id", "type");
+
+CREATE TABLE IF NOT EXISTS "png_cache" (
+	"link"	VARCHAR(512) NOT NULL PRIMARY KEY,
+	"circular_id"	INT,
+	"png_urls"	TEXT NOT NULL
 );
 
+CREATE INDEX "idx_png_cache_circular_id" ON "png_cache" ("circular_id");
+
 CREATE TABLE IF NOT EXISTS "search_feedback" (
-	"user_id"	INTEGER NOT NULL,
-	"message_id"	INTEGER NOT NULL UNIQUE,
+	"user_id"	BIGINT UNSIGNED NOT NULL,
+	"message_id"	BIGINT UNSIGNED NOT NULL UNIQUE,
 	"search_query"	TEXT NOT NULL,
 	"response"	TEXT NOT NULL
 );
 
-
-CREATE TABLE IF NOT EXISTS "notif_msgs" (
-    "timestamp" DATETIME DEFAULT NOW(),
-	"circular_id"	INTEGER NOT NULL,
-	"type"	TEXT NOT NULL,
-	"msg_id"	INTEGER NOT NULL UNIQUE,
-	"channel_id"	INTEGER,
-	"guild_id"	INTEGER
+CREATE TABLE IF NOT EXISTS "logs" (
+	"id"	INTEGER PRIMARY KEY,  -- INT AUTO_INCREMENT PRIMARY KEY on mysql
+	"timestamp"	DATETIME NOT NULL,
+	"level"	VARCHAR(50) NOT NULL,
+	"filename"	VARCHAR(255) NOT NULL,
+	"function_name"	VARCHAR(255) NOT NULL,
+	"line_number"	INT NOT NULL,
+	"thread_name"	VARCHAR(255) NOT NULL,
+	"process_id"	INT NOT NULL,
+	"message"	TEXT NOT NULL,
+	"exception_info"	TEXT NULL,
+	"category"	VARCHAR(16) NOT NULL DEFAULT 'etc'
 );
 
+CREATE INDEX "idx_logs_level_category_timestamp" ON "logs" ("level", "category", "timestamp");
+CREATE INDEX "idx_logs_level_timestamp" ON "logs" ("level", "timestamp");
+CREATE INDEX "idx_logs_category_timestamp" ON "logs" ("category", "timestamp");
+CREATE INDEX "idx_logs_timestamp" ON "logs" ("timestamp");
+
+-- The id of the latest circular seen by the circular checker
 CREATE TABLE IF NOT EXISTS "cache" (
-	"title"	TEXT,
-	"category"	TEXT,
-	"data"	BLOB
-);
\ No newline at end of file
+	"category"	VARCHAR(15) NOT NULL PRIMARY KEY,
+	"latest_circular_id"	INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS "notif_jobs" (
+	"id"	INTEGER PRIMARY KEY,  -- INT AUTO_INCREMENT PRIMARY KEY on mysql
+	"circular_id"	INT NOT NULL,
+	"category"	VARCHAR(32) NOT NULL,
+	"title"	TEXT NOT NULL,
+	"link"	TEXT NOT NULL,
+	"state"	VARCHAR(16) NOT NULL DEFAULT 'pending',  -- pending, done, failed
+	"attempts"	INT NOT NULL DEFAULT 0,
+	"created_at"	DATETIME NOT NULL,
+	"next_attempt_at"	DOUBLE NOT NULL DEFAULT 0  -- The unix time the job may run (again) at
+);
+
+CREATE INDEX "idx_notif_jobs_state" ON "notif_jobs" ("state");
+
+CREATE TABLE IF NOT EXISTS "notif_recipients" (
+	"job_id"	INT NOT NULL,
+	"type"	VARCHAR(16) NOT NULL,  -- guild, dm
+	"recipient_id"	BIGINT UNSIGNED NOT NULL,  -- The channel id for guilds, the user id for DMs
+	"guild_id"	BIGINT UNSIGNED,
+	"message"	TEXT,
+	"state"	VARCHAR(16) NOT NULL DEFAULT 'pending',  -- pending, sent, failed, removed
+	"attempts"	INT NOT NULL DEFAULT 0,
+	PRIMARY KEY ("job_id", "type", "recipient_id")
+);
+
+CREATE TABLE IF NOT EXISTS "bot_state" (
+	"name"	VARCHAR(64) NOT NULL PRIMARY KEY,
+	"value"	TEXT NOT NULL  -- JSON
+);